@@ -0,0 +1,184 @@
+import asyncio
+import io
+from datetime import datetime
+from typing import AsyncIterator, List
+
+import numpy as np
+import pandas as pd
+
+
+# Log-spaced duration histogram bins, 1 second to 30 days at ~2% relative width
+DURATION_BINS = np.concatenate(([0.0], np.geomspace(1.0, 30 * 24 * 3600.0, 800), [np.inf]))
+
+EXPORT_COLUMNS = ["id", "server_id", "status", "started_at", "ended_at", "duration_seconds"]
+
+
+def to_columns(batch: List[dict]) -> pd.DataFrame:
+    """Columnar view of a batch of connection documents.
+
+    Sessions that have not ended have a NaN duration, which keeps them out of the
+    duration percentiles; SessionStats clips them to `until` for concurrency and usage.
+    """
+    frame = pd.DataFrame.from_records(batch, columns=EXPORT_COLUMNS[:-1])
+    frame["server_id"] = frame["server_id"].astype(object)
+    frame["status"] = frame["status"].map(lambda status: getattr(status, "value", status))
+    frame["started_at"] = pd.to_datetime(frame["started_at"])
+    frame["ended_at"] = pd.to_datetime(frame["ended_at"])
+    frame["duration_seconds"] = (frame["ended_at"] - frame["started_at"]).dt.total_seconds()
+    return frame
+
+
+class SessionStats:
+    """Session statistics accumulated batch by batch in bounded memory.
+
+    Durations go into a fixed log-spaced histogram, concurrency into a +1/-1
+    difference array over `resolution`-second buckets of [since, until), and usage
+    into per-server totals. Memory therefore depends on the time range and the
+    number of servers, not on the number of sessions.
+    """
+
+    def __init__(self, since: datetime, until: datetime, resolution: int = 60):
+        self.since = np.datetime64(since, "s")
+        self.until = until
+        self.resolution = resolution
+        self.buckets = max(1, int(np.ceil((until - since).total_seconds() / resolution)))
+        self.concurrency_diff = np.zeros(self.buckets + 1, dtype=np.int64)
+        self.duration_counts = np.zeros(len(DURATION_BINS) - 1, dtype=np.int64)
+        self.duration_sum = 0.0
+        self.duration_max = 0.0
+        self.sessions = 0
+        self.open_sessions = 0
+        self.usage = pd.DataFrame(columns=["sessions", "total_seconds"], dtype=float)
+
+    def add(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        self.sessions += len(frame)
+        ended = frame["ended_at"].fillna(pd.Timestamp(self.until))
+        clipped = (ended - frame["started_at"]).dt.total_seconds().clip(lower=0)
+
+        durations = frame["duration_seconds"].dropna().to_numpy()
+        self.open_sessions += len(frame) - len(durations)
+        if len(durations):
+            self.duration_counts += np.histogram(durations, bins=DURATION_BINS)[0]
+            self.duration_sum += durations.sum()
+            self.duration_max = max(self.duration_max, durations.max())
+
+        start_offsets = (frame["started_at"].to_numpy().astype("datetime64[s]") - self.since).astype(np.int64)
+        end_offsets = (ended.to_numpy().astype("datetime64[s]") - self.since).astype(np.int64)
+        first = np.clip(start_offsets // self.resolution, 0, self.buckets - 1)
+        last = np.clip(end_offsets // self.resolution, first, self.buckets - 1)
+        # In place, so a batch costs O(batch) rather than O(buckets)
+        np.add.at(self.concurrency_diff, first, 1)
+        np.add.at(self.concurrency_diff, last + 1, -1)
+
+        batch_usage = pd.DataFrame({"server_id": frame["server_id"], "seconds": clipped}).groupby("server_id").agg(
+            sessions=("seconds", "size"), total_seconds=("seconds", "sum")
+        )
+        self.usage = self.usage.add(batch_usage, fill_value=0)
+
+    def duration_percentile(self, q: float) -> float:
+        total = self.duration_counts.sum()
+        if total == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.duration_counts), q * total))
+        # Upper edge of the bin, capped by the largest duration seen
+        return float(min(DURATION_BINS[index + 1], self.duration_max))
+
+    def result(self) -> dict:
+        concurrency = np.cumsum(self.concurrency_diff[:-1])
+        peak_bucket = int(concurrency.argmax()) if concurrency.size else 0
+        completed = int(self.duration_counts.sum())
+        usage = self.usage.sort_values("total_seconds", ascending=False)
+        return {
+            "since": pd.Timestamp(self.since).to_pydatetime(),
+            "until": self.until,
+            "sessions": self.sessions,
+            "open_sessions": self.open_sessions,
+            "duration_seconds": {
+                "mean": self.duration_sum / completed if completed else 0.0,
+                "p50": self.duration_percentile(0.50),
+                "p90": self.duration_percentile(0.90),
+                "p99": self.duration_percentile(0.99),
+                "max": float(self.duration_max),
+            },
+            "peak_concurrency": int(concurrency.max()) if concurrency.size else 0,
+            "peak_concurrency_at": (pd.Timestamp(self.since) + pd.Timedelta(seconds=peak_bucket * self.resolution)).to_pydatetime(),
+            "resolution_seconds": self.resolution,
+            "servers": [
+                {"server_id": server_id, "sessions": int(row.sessions), "total_seconds": float(row.total_seconds)}
+                for server_id, row in usage.iterrows()
+            ],
+        }
+
+
+# The numpy and pandas work below runs in worker threads to keep it off the event loop
+
+async def session_stats(batches: AsyncIterator[List[dict]], since: datetime, until: datetime, resolution: int = 60) -> dict:
+    stats = SessionStats(since, until, resolution)
+    async for batch in batches:
+        await asyncio.to_thread(lambda: stats.add(to_columns(batch)))
+    return await asyncio.to_thread(stats.result)
+
+
+def _csv(batch: List[dict], header: bool) -> str:
+    return to_columns(batch).to_csv(index=False, header=header, date_format="%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+async def export_csv(batches: AsyncIterator[List[dict]]):
+    header = True
+    async for batch in batches:
+        yield await asyncio.to_thread(_csv, batch, header)
+        header = False
+    if header:
+        yield ",".join(EXPORT_COLUMNS) + "\n"
+
+
+class ParquetChunks(io.RawIOBase):
+    """Write-only sink handing out what the Parquet writer produced so far.
+
+    tell() keeps counting across drains, so the row-group offsets in the footer
+    stay valid while only the undrained bytes are held in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+async def export_parquet(batches: AsyncIterator[List[dict]]):
+    """Parquet file with one row group per batch; needs the optional pyarrow package"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.string()), ("server_id", pa.string()), ("status", pa.string()),
+        ("started_at", pa.timestamp("us")), ("ended_at", pa.timestamp("us")),
+        ("duration_seconds", pa.float64()),
+    ])
+    sink = ParquetChunks()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write(batch: List[dict]) -> bytes:
+        writer.write_table(pa.Table.from_pandas(to_columns(batch), schema=schema, preserve_index=False))
+        return sink.drain()
+
+    async for batch in batches:
+        yield await asyncio.to_thread(write, batch)
+    writer.close()
+    yield sink.drain()
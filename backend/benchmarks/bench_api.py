@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Throughput of the hot API endpoints against the in-memory storage backend.
+
+Runs the app in-process through httpx's ASGI transport, so the numbers reflect
+routing, validation and serialization rather than MongoDB. Guacamole does not
+need to be running; provisioning simply fails fast while servers are seeded.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.pop("STORAGE_PATH", None)
+os.environ.setdefault("CREDENTIALS_KEY", Fernet.generate_key().decode())
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from server import app  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SERVERS = 500
+REQUESTS = 2000
+
+
+async def timed(name, client, make_request):
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        response = await make_request(client, i)
+        assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {REQUESTS / elapsed:>9,.0f} req/s  {1e6 * elapsed / REQUESTS:>7,.0f} us/req")
+
+
+async def main():
+    await app.router.startup()
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            server_ids = []
+            for i in range(SERVERS):
+                response = await client.post("/api/rdp-servers", json={
+                    "name": f"Server {i}", "host": f"host-{i}.example.com",
+                    "username": "administrator", "password": "SecureP@ssw0rd!",
+                    "os_type": ["windows", "linux"][i % 2],
+                })
+                server_ids.append(response.json()["id"])
+
+            await timed("GET /api/rdp-servers/{id}", client,
+                        lambda c, i: c.get(f"/api/rdp-servers/{server_ids[i % SERVERS]}"))
+            await timed("GET /api/rdp-servers?limit=50", client,
+                        lambda c, i: c.get("/api/rdp-servers", params={"limit": 50, "os_type": "linux"}))
+
+            async def connect_and_end(c, i):
+                response = await c.post("/api/connections", json={"server_id": server_ids[i % SERVERS]})
+                return await c.delete(f"/api/connections/{response.json()['id']}")
+
+            await timed("POST+DELETE /api/connections", client, connect_and_end)
+    finally:
+        await app.router.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
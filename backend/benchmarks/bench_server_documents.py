@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Compare rdp_servers documents with inline credentials against the split layout.
+
+Measures the BSON size of a server document and how many documents per second
+can be encoded, decoded and validated into RDPServer, which is what every list
+and detail request does. Runs without MongoDB.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import bson
+from cryptography.fernet import Fernet
+
+os.environ.setdefault("CREDENTIALS_KEY", Fernet.generate_key().decode())
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from server import RDPServer, encrypt_secret  # noqa: E402
+
+DOCUMENTS = 1000
+ROUNDS = 20
+
+
+def make_documents(inline_credentials: bool):
+    documents = []
+    for i in range(DOCUMENTS):
+        document = RDPServer(
+            name=f"Windows Server {i}",
+            host=f"win-{i}.example.com",
+            username="administrator",
+            domain="EXAMPLE",
+            description="Benchmark server",
+        ).dict()
+        if inline_credentials:
+            document["password"] = f"SecureP@ssw0rd-{i}!"
+        documents.append(document)
+    return documents
+
+
+def measure(documents):
+    encoded = [bson.encode(document) for document in documents]
+    average_size = sum(len(raw) for raw in encoded) / len(encoded)
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for raw in encoded:
+            RDPServer(**bson.decode(raw))
+    elapsed = time.perf_counter() - start
+    return average_size, DOCUMENTS * ROUNDS / elapsed
+
+
+def main():
+    inline_size, inline_rate = measure(make_documents(inline_credentials=True))
+    split_size, split_rate = measure(make_documents(inline_credentials=False))
+    credentials_size = len(bson.encode({"server_id": "x" * 36, "password": encrypt_secret("SecureP@ssw0rd-0!")}))
+
+    print(f"inline credentials: {inline_size:.0f} bytes/doc, {inline_rate:,.0f} docs/s")
+    print(f"split credentials:  {split_size:.0f} bytes/doc, {split_rate:,.0f} docs/s")
+    print(f"rdp_credentials:    {credentials_size} bytes/doc (read only when provisioning)")
+    print(f"size reduction: {100 * (1 - split_size / inline_size):.1f}%, "
+          f"throughput gain: {100 * (split_rate / inline_rate - 1):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionEventType(str, Enum):
+    PROVISION = "provision"
+    CONNECT = "connect"
+    DISCONNECT = "disconnect"
+
+
+class SessionEventLog:
+    """Buffered audit trail of session events.
+
+    record() only appends to a bounded in-memory buffer so request handlers never
+    wait on the database. A background task writes the buffer with insert_many once
+    batch_size events are queued or every flush_interval seconds, whichever comes
+    first. Events recorded while the buffer is full are dropped and counted.
+    """
+
+    def __init__(self, collection, max_buffer: int = 10000, batch_size: int = 500, flush_interval: float = 1.0):
+        self.collection = collection
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def record(self, event_type: SessionEventType, server_id: str, connection_id: Optional[str] = None, **details):
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append({
+            "id": str(uuid.uuid4()),
+            "event_type": event_type,
+            "server_id": server_id,
+            "connection_id": connection_id,
+            "details": details,
+            "timestamp": datetime.utcnow(),
+        })
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write everything currently buffered, one insert_many per batch"""
+        async with self._flush_lock:
+            while self._buffer:
+                count = min(len(self._buffer), self.batch_size)
+                batch = [self._buffer.popleft() for _ in range(count)]
+                started = time.perf_counter()
+                try:
+                    await self.collection.insert_many(batch, ordered=False)
+                    self.written += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    logger.error(f"Failed to write {len(batch)} session events: {e}")
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.flush_seconds_total += elapsed
+                self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write whatever is still buffered"""
+        if self._task is not None:
+            # Let an in-progress insert_many finish instead of cancelling it mid-batch
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "flush_latency_avg_ms": 1000 * self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+            "flush_latency_max_ms": 1000 * self.flush_seconds_max,
+        }
@@ -0,0 +1,49 @@
+import bisect
+import hashlib
+from typing import Dict, List
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class GuacamolePool:
+    """Placement of RDP servers on a pool of Guacamole backends.
+
+    Servers are placed by consistent hashing of their id, so adding a backend
+    only moves the servers whose ring segment it takes over. When the hashed
+    backend already carries more than (1 + slack) times the average load, the
+    least-loaded backend is used instead.
+    """
+
+    def __init__(self, urls: List[str], virtual_nodes: int = 100, slack: float = 0.25):
+        if not urls:
+            raise ValueError("At least one Guacamole backend is required")
+        self.urls = list(dict.fromkeys(url.rstrip("/") for url in urls))
+        self.slack = slack
+        self._ring = sorted(
+            (_hash(f"{url}#{replica}"), url) for url in self.urls for replica in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    @property
+    def default_url(self) -> str:
+        return self.urls[0]
+
+    def hashed_url(self, key: str) -> str:
+        """Backend owning key on the hash ring, ignoring load"""
+        index = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+    def place(self, key: str, loads: Dict[str, int]) -> str:
+        """Backend for a new server, given the number of servers on each backend"""
+        url = self.hashed_url(key)
+        counts = {backend: loads.get(backend, 0) for backend in self.urls}
+        average = sum(counts.values()) / len(self.urls)
+        if counts[url] + 1 > (1 + self.slack) * (average + 1):
+            url = min(self.urls, key=lambda backend: (counts[backend], backend))
+        return url
+
+    def resolve(self, url: str) -> str:
+        """Backend to use for a stored guacamole_url; servers created before sharding have none"""
+        return url.rstrip("/") if url else self.default_url
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+# Left out of fingerprints, which are stored unsalted for the whole TTL
+SECRET_FIELDS = frozenset({"password"})
+
+
+def request_fingerprint(payload) -> str:
+    """Hash of a request body, used to reject a key reused with a different request"""
+    body = jsonable_encoder(payload)
+    if isinstance(body, dict):
+        body = {field: value for field, value in body.items() if field not in SECRET_FIELDS}
+    raw = json.dumps(body, sort_keys=True).encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+class IdempotencyStore:
+    """Replay-safe execution of POST handlers keyed by the Idempotency-Key header.
+
+    The first request with a key claims it with a pending record (unique on scope
+    and key), runs the handler and stores the JSON response. Replays within the
+    TTL window get the stored response without running the handler again.
+    Concurrent duplicates in the same worker await the in-flight execution;
+    duplicates hitting another worker poll the stored record, backing off up to
+    `max_poll_interval`, until it completes. Failed executions release the key so
+    the client can retry. A pending claim older than `pending_timeout_seconds`,
+    left by a worker that died mid-request, is taken over by the next request
+    with the key.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 24 * 3600, pending_timeout_seconds: float = 120,
+                 poll_interval: float = 0.05, max_poll_interval: float = 1.0):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.pending_timeout_seconds = pending_timeout_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    @property
+    def indexes(self):
+        return [
+            IndexModel([("scope", ASCENDING), ("key", ASCENDING)], unique=True),
+            IndexModel([("created_at", ASCENDING)], expireAfterSeconds=self.ttl_seconds),
+        ]
+
+    async def run(self, scope: str, key: str, fingerprint: str, execute: Callable[[], Awaitable]):
+        """Return (response, replayed) for the request identified by scope and key"""
+        in_flight = self._in_flight.get((scope, key))
+        if in_flight is not None:
+            response, fingerprint_in_flight = await asyncio.shield(in_flight)
+            self._check_fingerprint(fingerprint, fingerprint_in_flight)
+            return response, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[(scope, key)] = future
+        try:
+            response, replayed = await self._claim_and_execute(scope, key, fingerprint, execute)
+            future.set_result((response, fingerprint))
+            return response, replayed
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on this future
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[(scope, key)]
+
+    async def _claim_and_execute(self, scope, key, fingerprint, execute):
+        claim = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "scope": scope,
+                "key": key,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "claim": claim,
+                "pending_until": now + timedelta(seconds=self.pending_timeout_seconds),
+                "created_at": now,
+            })
+        except DuplicateKeyError:
+            return await self._await_stored(scope, key, fingerprint, execute)
+
+        # Conditioned on the claim so a request that outlived it cannot clobber its successor
+        owned = {"scope": scope, "key": key, "claim": claim}
+        try:
+            response = jsonable_encoder(await execute())
+        except BaseException:
+            await self.collection.delete_one(owned)
+            raise
+
+        await self.collection.update_one(owned, {"$set": {"status": "completed", "response": response}})
+        return response, False
+
+    async def _await_stored(self, scope, key, fingerprint, execute):
+        """Wait for another worker's execution of the key, or take it over once abandoned"""
+        delay = self.poll_interval
+        while True:
+            stored = await self.collection.find_one({"scope": scope, "key": key})
+            if stored is None:
+                # Expired, or released by a failed execution
+                return await self._claim_and_execute(scope, key, fingerprint, execute)
+            self._check_fingerprint(fingerprint, stored["fingerprint"])
+            if stored["status"] == "completed":
+                return stored["response"], True
+            if stored.get("pending_until") and stored["pending_until"] <= datetime.utcnow():
+                # Abandoned claim; the unique index lets only one retry re-claim it
+                await self.collection.delete_one({"scope": scope, "key": key, "claim": stored["claim"]})
+                return await self._claim_and_execute(scope, key, fingerprint, execute)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    @staticmethod
+    def _check_fingerprint(fingerprint: str, stored_fingerprint: str):
+        if fingerprint != stored_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
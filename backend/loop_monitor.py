@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Continuous event-loop lag measurement with stall tracing.
+
+    A coroutine sleeps for interval seconds and records how late it wakes up,
+    which is the scheduling delay every other task on the loop sees. A watchdog
+    thread checks the coroutine's heartbeat; once the loop has not turned for
+    threshold seconds it captures the loop thread's stack and the task that is
+    running, i.e. the code that is blocking everything else.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, window: int = 600, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=window)
+        self.stalls = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval / 2):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.threshold or reported == heartbeat:
+                continue
+            # Report each stall once, while the blocking code is still on the stack
+            reported = heartbeat
+            self._capture(stalled_for)
+
+    def _capture(self, stalled_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        task = asyncio.current_task(self._loop)
+        stall = {
+            "detected_at": time.time(),
+            "lag_ms": 1000 * stalled_for,
+            "task": task.get_name() if task else None,
+            "coroutine": getattr(task.get_coro(), "__qualname__", None) if task else None,
+            "stack": traceback.format_stack(frame) if frame else [],
+        }
+        self.stalls.append(stall)
+        self.stall_count += 1
+        logger.warning(
+            f"Event loop blocked for {stall['lag_ms']:.0f} ms in task {stall['task']} "
+            f"({stall['coroutine']}):\n{''.join(stall['stack'][-10:])}"
+        )
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._measure())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags)
+
+        def percentile(p):
+            return 1000 * lags[min(len(lags) - 1, int(p * len(lags)))] if lags else 0.0
+
+        return {
+            "lag_ms": 1000 * self.lags[-1] if self.lags else 0.0,
+            "lag_p50_ms": percentile(0.50),
+            "lag_p99_ms": percentile(0.99),
+            "lag_max_ms": 1000 * self.max_lag,
+            "threshold_ms": 1000 * self.threshold,
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+        }
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SIGNATURE_HEADER = "x-profile-signature"
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def sign_profile_request(secret: str, method: str, path: str, expires: int) -> str:
+    """Value of the X-Profile-Signature header that requests a profile of one call"""
+    digest = hmac.new(secret.encode(), f"{expires}:{method}:{path}".encode(), hashlib.sha256).hexdigest()
+    return f"{expires}:{digest}"
+
+
+class TaskSampler:
+    """Samples the stack of one asyncio task from a background thread.
+
+    Each tick walks the task's coroutine chain. When the task is suspended the
+    leaf is the object it awaits (a Motor future, an httpx socket read...), so
+    time spent waiting on I/O shows up next to time spent on the CPU. When the
+    task is running, the frames below its innermost coroutine are taken from
+    the loop thread's stack.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float = 0.005):
+        self.task = task
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stack = self._sample()
+            except Exception:
+                # The loop thread mutates the coroutine chain while we walk it
+                continue
+            if stack:
+                self.samples[";".join(stack)] += 1
+
+    def _sample(self) -> List[str]:
+        stack = []
+        coro = self.task.get_coro()
+        innermost = None
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(frame_label(frame))
+            innermost = coro
+            awaited = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+            if awaited is None or not (hasattr(awaited, "cr_frame") or hasattr(awaited, "gi_frame")):
+                if awaited is not None:
+                    stack.append(f"[await {type(awaited).__name__}]")
+                break
+            coro = awaited
+
+        if innermost is not None and getattr(innermost, "cr_running", False):
+            top = sys._current_frames().get(self._thread_id)
+            running = []
+            inner_frame = innermost.cr_frame
+            while top is not None and top is not inner_frame:
+                running.append(frame_label(top))
+                top = top.f_back
+            if top is inner_frame:
+                stack.extend(reversed(running))
+        return stack
+
+
+class ProfileStore:
+    """Bounded on-disk ring buffer of collapsed-stack profiles.
+
+    Each profile is a <id>.folded file in the format read by flamegraph.pl,
+    speedscope and inferno, with its request metadata in <id>.json. Once
+    max_profiles are stored the oldest ones are removed.
+    """
+
+    def __init__(self, directory: Path, max_profiles: int = 100):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def save(self, samples: Counter, metadata: dict) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        profile_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        folded = "".join(f"{stack} {count}\n" for stack, count in samples.items())
+        (self.directory / f"{profile_id}.folded").write_text(folded)
+        (self.directory / f"{profile_id}.json").write_text(json.dumps({"id": profile_id, **metadata}))
+        for stale in self._ids()[:-self.max_profiles]:
+            for suffix in (".folded", ".json"):
+                (self.directory / f"{stale}{suffix}").unlink(missing_ok=True)
+        return profile_id
+
+    def _ids(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return sorted(path.stem for path in self.directory.glob("*.json"))
+
+    def list(self) -> List[dict]:
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                profiles.append(json.loads((self.directory / f"{profile_id}.json").read_text()))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def read(self, profile_id: str) -> Optional[str]:
+        if profile_id not in self._ids():
+            return None
+        return (self.directory / f"{profile_id}.folded").read_text()
+
+
+class ProfilingMiddleware:
+    """Opt-in per-request sampling profiler.
+
+    A request is profiled when it carries a valid, unexpired X-Profile-Signature
+    header (see sign_profile_request) or is picked by sample_rate. Signatures
+    expiring more than max_signature_age seconds ahead are refused, so a leaked
+    one cannot be replayed for long. This is a plain ASGI middleware so the
+    endpoint runs in the same task that is sampled.
+    """
+
+    def __init__(self, app, store: ProfileStore, secret: Optional[str] = None, sample_rate: float = 0.0,
+                 path_prefix: str = "/api/", exclude_prefix: str = "/api/admin/", interval: float = 0.005,
+                 max_signature_age: float = 300.0):
+        self.app = app
+        self.store = store
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.path_prefix = path_prefix
+        self.exclude_prefix = exclude_prefix
+        self.interval = interval
+        self.max_signature_age = max_signature_age
+
+    def should_profile(self, scope) -> bool:
+        path = scope["path"]
+        if not path.startswith(self.path_prefix) or path.startswith(self.exclude_prefix):
+            return False
+        if self.secret:
+            headers = dict(scope["headers"])
+            signature = headers.get(PROFILE_SIGNATURE_HEADER.encode())
+            if signature:
+                try:
+                    expires = int(signature.decode().split(":", 1)[0])
+                except ValueError:
+                    expires = 0
+                expected = sign_profile_request(self.secret, scope["method"], path, expires)
+                remaining = expires - time.time()
+                if 0 <= remaining <= self.max_signature_age and hmac.compare_digest(signature.decode(), expected):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = TaskSampler(asyncio.current_task(), self.interval)
+        status = {}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+            metadata = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status_code": status.get("code"),
+                "duration_ms": 1000 * (time.perf_counter() - started),
+                "samples": sum(sampler.samples.values()),
+                "interval_ms": 1000 * self.interval,
+                "created_at": time.time(),
+            }
+            try:
+                await asyncio.to_thread(self.store.save, sampler.samples, metadata)
+            except OSError as e:
+                logger.error(f"Failed to store request profile: {e}")
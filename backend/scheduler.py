@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Awaitable]
+    interval: float
+    jitter: float = 0.1
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    lost_leases: int = 0
+    leader: bool = False
+    running: bool = False
+    last_run_at: Optional[datetime] = None
+    last_duration: float = 0.0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    last_error: Optional[str] = None
+    last_result: object = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped_not_leader": self.skipped,
+            "lost_leases": self.lost_leases,
+            "leader": self.leader,
+            "running": self.running,
+            "last_run_at": self.last_run_at,
+            "last_duration_ms": 1000 * self.last_duration,
+            "avg_duration_ms": 1000 * self.total_duration / self.runs if self.runs else 0.0,
+            "max_duration_ms": 1000 * self.max_duration,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+        }
+
+
+class JobScheduler:
+    """Periodic maintenance jobs, run by one worker at a time across a deployment.
+
+    Before each run a worker takes the job's lease in storage for one interval.
+    Other workers find the lease held and skip, so a job runs about once per
+    interval cluster-wide no matter how many uvicorn workers are up. The lease is
+    renewed while a run takes longer than a third of the interval, so a slow run
+    is never overlapped by another worker, and runs of a job in one worker are
+    sequential. Jitter spreads the workers' attempts. A run whose renewal is
+    refused keeps going but is counted as a lost lease, since another worker
+    may start the job before it finishes.
+    """
+
+    def __init__(self, storage, owner: Optional[str] = None):
+        self.storage = storage
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, Job] = {}
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], interval: float, jitter: float = 0.1):
+        self.jobs[name] = Job(name, func, interval, jitter)
+
+    async def run_once(self, job: Job) -> bool:
+        """Run job if this worker gets its lease; returns whether it ran"""
+        lease_name = f"job:{job.name}"
+        job.leader = await self.storage.acquire_lease(lease_name, self.owner, job.interval)
+        if not job.leader:
+            job.skipped += 1
+            return False
+
+        renewal = asyncio.create_task(self._renew(job, lease_name))
+        job.running = True
+        job.last_run_at = datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            job.last_result = await job.func()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = repr(e)
+            logger.exception(f"Scheduled job {job.name} failed")
+        finally:
+            renewal.cancel()
+            job.running = False
+            job.last_duration = time.perf_counter() - started
+            job.total_duration += job.last_duration
+            job.max_duration = max(job.max_duration, job.last_duration)
+            job.runs += 1
+            await asyncio.gather(renewal, return_exceptions=True)
+        return True
+
+    async def _renew(self, job: Job, lease_name: str):
+        while True:
+            await asyncio.sleep(job.interval / 3)
+            try:
+                renewed = await self.storage.acquire_lease(lease_name, self.owner, job.interval)
+            except Exception:
+                # Retried at the next renewal, the lease is still valid until then
+                logger.exception(f"Could not renew the lease of job {job.name}")
+                continue
+            if not renewed:
+                job.leader = False
+                job.lost_leases += 1
+                logger.warning(f"Job {job.name} lost its lease while running, another worker may run it concurrently")
+                return
+
+    async def _loop(self, job: Job):
+        while True:
+            await asyncio.sleep(job.next_delay())
+            try:
+                await self.run_once(job)
+            except Exception:
+                # Lease storage unavailable, try again next interval
+                logger.exception(f"Could not schedule job {job.name}")
+
+    def start(self):
+        for job in self.jobs.values():
+            if job.task is None:
+                job.task = asyncio.create_task(self._loop(job))
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    pass
+                job.task = None
+
+    def stats(self) -> List[dict]:
+        return [job.stats() for job in self.jobs.values()]
@@ -1,30 +1,86 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Form, Query, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime
+import hmac
+import time
+import math
+from datetime import datetime, timedelta, timezone
+import importlib.util
 from enum import Enum
 import httpx
 import asyncio
+from cryptography.fernet import Fernet, InvalidToken
+
+from event_log import SessionEventLog, SessionEventType
+from idempotency import IDEMPOTENCY_KEY_HEADER, IdempotencyStore, request_fingerprint
+from profiling import ProfileStore, ProfilingMiddleware
+from loop_monitor import LoopLagMonitor
+from storage import MemoryStorage, MotorStorage, encode_cursor
+from guacamole_pool import GuacamolePool
+import analytics
+from scheduler import JobScheduler
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage backend: "mongo" (default) or "memory", optionally persisted to STORAGE_PATH
+if os.environ.get('STORAGE_BACKEND', 'mongo') == 'memory':
+    storage = MemoryStorage(os.environ.get('STORAGE_PATH'))
+else:
+    # MongoDB connection, only configured for the mongo backend
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    storage = MotorStorage(client[os.environ['DB_NAME']])
+
+# Audit trail of session events, written in batches off the request path
+session_events = SessionEventLog(storage.session_events)
+
+# Stored responses of POST requests carrying an Idempotency-Key header
+idempotency_store = IdempotencyStore(storage.idempotency_keys)
+
+# Shared secret for the /api/admin endpoints, which are disabled without it
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# On-demand request profiling, triggered by a signed header or a sampling rate
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET')
+profile_store = ProfileStore(
+    os.environ.get('PROFILE_DIR', ROOT_DIR / 'profiles'),
+    max_profiles=int(os.environ.get('PROFILE_MAX_COUNT', '100'))
+)
+
+# Event-loop lag measurement, traces the task holding the loop past the threshold
+loop_monitor = LoopLagMonitor(threshold=float(os.environ.get('LOOP_LAG_THRESHOLD_MS', '100')) / 1000)
+
+# Periodic maintenance jobs, each run by one worker at a time through storage leases
+scheduler = JobScheduler(storage)
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+STALE_SESSION_HOURS = float(os.environ.get('STALE_SESSION_HOURS', '12'))
 
-# Guacamole configuration
-GUACAMOLE_URL = "http://localhost:8080"
+# Guacamole configuration, GUACAMOLE_URLS (comma-separated) shards connections over several backends
+GUACAMOLE_URL = os.environ.get('GUACAMOLE_URL', "http://localhost:8080")
+guacamole_pool = GuacamolePool(os.environ.get('GUACAMOLE_URLS', GUACAMOLE_URL).split(','))
+
+# Credentials are kept out of rdp_servers and encrypted at rest in rdp_credentials
+def load_credentials_cipher() -> Fernet:
+    key = os.environ.get('CREDENTIALS_KEY')
+    hint = 'Generate one with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"'
+    if not key:
+        raise RuntimeError(f"CREDENTIALS_KEY is not set. {hint}")
+    try:
+        return Fernet(key.encode())
+    except ValueError:
+        raise RuntimeError(f"CREDENTIALS_KEY is not a valid Fernet key. {hint}")
+
+credentials_cipher = load_credentials_cipher()
 
 # Create the main app without a prefix
 app = FastAPI(title="RDP Manager API", description="API for managing RDP connections with Guacamole integration")
@@ -53,12 +109,12 @@ class RDPServer(BaseModel):
     host: str
     port: int = 3389
     username: str
-    password: str
     domain: Optional[str] = None
     os_type: OSType = OSType.WINDOWS
     description: Optional[str] = None
     status: RDPStatus = RDPStatus.INACTIVE
     guacamole_connection_id: Optional[str] = None
+    guacamole_url: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -82,6 +138,13 @@ class RDPServerUpdate(BaseModel):
     os_type: Optional[OSType] = None
     description: Optional[str] = None
 
+class RDPServerBulkUpdate(RDPServerUpdate):
+    id: str
+
+class RDPCredentials(BaseModel):
+    server_id: str
+    password: str
+
 class RDPConnection(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     server_id: str
@@ -99,13 +162,59 @@ class GuacamoleCredentials(BaseModel):
     password: str = "guacadmin"
 
 
+# Idempotent request helpers
+async def run_idempotent(scope: str, idempotency_key: Optional[str], payload: BaseModel, response: Response, execute):
+    """Run a POST handler once per Idempotency-Key, replaying the stored response on retries"""
+    if not idempotency_key:
+        return await execute()
+    result, replayed = await idempotency_store.run(scope, idempotency_key, request_fingerprint(payload), execute)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+# Credential storage helpers
+def encrypt_secret(secret: str) -> str:
+    return credentials_cipher.encrypt(secret.encode()).decode()
+
+def decrypt_secret(token: str) -> str:
+    return credentials_cipher.decrypt(token.encode()).decode()
+
+async def store_server_credentials(server_id: str, password: str):
+    """Encrypt and upsert the credentials of a server"""
+    await storage.set_credentials(server_id, {"password": encrypt_secret(password), "updated_at": datetime.utcnow()})
+
+async def load_server_credentials(server_id: str) -> Optional[RDPCredentials]:
+    """Read and decrypt the credentials of a server, only needed when provisioning"""
+    document = await storage.get_credentials(server_id)
+    if not document:
+        return None
+    try:
+        return RDPCredentials(server_id=server_id, password=decrypt_secret(document["password"]))
+    except InvalidToken:
+        logging.error(f"Unable to decrypt credentials for server {server_id}")
+        return None
+
+async def migrate_inline_credentials():
+    """Move passwords still stored inline on rdp_servers into rdp_credentials"""
+    migrated = await storage.migrate_inline_credentials(encrypt_secret)
+    if migrated:
+        logging.info(f"Migrated inline credentials of {migrated} RDP servers")
+    return migrated
+
+
 # Guacamole API helper functions
-async def authenticate_guacamole(username: str, password: str):
+def guacamole_backend(server) -> str:
+    """Guacamole backend holding the connection of a server document or model"""
+    url = server.get("guacamole_url") if isinstance(server, dict) else server.guacamole_url
+    return guacamole_pool.resolve(url)
+
+async def authenticate_guacamole(username: str, password: str, base_url: Optional[str] = None):
     """Authenticate with Guacamole and get session token"""
     try:
         async with httpx.AsyncClient() as client:
             response = await client.post(
-                f"{GUACAMOLE_URL}/guacamole/api/tokens",
+                f"{base_url or guacamole_pool.default_url}/guacamole/api/tokens",
                 data={"username": username, "password": password},
                 timeout=30.0
             )
@@ -117,28 +226,33 @@ async def authenticate_guacamole(username: str, password: str):
         logging.error(f"Guacamole authentication error: {e}")
         return None
 
-async def create_guacamole_connection(auth_token: str, server: RDPServer):
+def build_guacamole_connection_data(server: RDPServer, credentials: RDPCredentials) -> dict:
+    connection_data = {
+        "name": server.name,
+        "parentIdentifier": "ROOT",
+        "protocol": "rdp",
+        "parameters": {
+            "hostname": server.host,
+            "port": str(server.port),
+            "username": server.username,
+            "password": credentials.password,
+            "security": "any",
+            "ignore-cert": "true"
+        }
+    }
+    
+    if server.domain:
+        connection_data["parameters"]["domain"] = server.domain
+    return connection_data
+
+async def create_guacamole_connection(auth_token: str, server: RDPServer, credentials: RDPCredentials):
     """Create a connection in Guacamole"""
     try:
-        connection_data = {
-            "name": server.name,
-            "protocol": "rdp",
-            "parameters": {
-                "hostname": server.host,
-                "port": str(server.port),
-                "username": server.username,
-                "password": server.password,
-                "security": "any",
-                "ignore-cert": "true"
-            }
-        }
-        
-        if server.domain:
-            connection_data["parameters"]["domain"] = server.domain
+        connection_data = build_guacamole_connection_data(server, credentials)
 
         async with httpx.AsyncClient() as client:
             response = await client.post(
-                f"{GUACAMOLE_URL}/guacamole/api/session/data/postgresql/connections",
+                f"{guacamole_backend(server)}/guacamole/api/session/data/postgresql/connections",
                 params={"token": auth_token},
                 json=connection_data,
                 timeout=30.0
@@ -152,12 +266,30 @@ async def create_guacamole_connection(auth_token: str, server: RDPServer):
         logging.error(f"Error creating Guacamole connection: {e}")
         return None
 
-async def delete_guacamole_connection(auth_token: str, connection_id: str):
+async def update_guacamole_connection(auth_token: str, server: RDPServer, credentials: RDPCredentials):
+    """Replace the name and parameters of an existing Guacamole connection"""
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.put(
+                f"{guacamole_backend(server)}/guacamole/api/session/data/postgresql/connections/{server.guacamole_connection_id}",
+                params={"token": auth_token},
+                json=build_guacamole_connection_data(server, credentials),
+                timeout=30.0
+            )
+            if response.status_code == 204:
+                return True
+            logging.error(f"Failed to update Guacamole connection: {response.text}")
+            return False
+    except Exception as e:
+        logging.error(f"Error updating Guacamole connection: {e}")
+        return False
+
+async def delete_guacamole_connection(auth_token: str, connection_id: str, base_url: Optional[str] = None):
     """Delete a connection from Guacamole"""
     try:
         async with httpx.AsyncClient() as client:
             response = await client.delete(
-                f"{GUACAMOLE_URL}/guacamole/api/session/data/postgresql/connections/{connection_id}",
+                f"{base_url or guacamole_pool.default_url}/guacamole/api/session/data/postgresql/connections/{connection_id}",
                 params={"token": auth_token},
                 timeout=30.0
             )
@@ -167,16 +299,258 @@ async def delete_guacamole_connection(auth_token: str, connection_id: str):
         return False
 
 
+# Fields of RDPServer that end up in the Guacamole connection
+GUACAMOLE_SYNCED_FIELDS = {"name", "host", "port", "username", "password", "domain"}
+
+def diff_guacamole_fields(server: dict, update_data: dict) -> set:
+    """Fields of an update that change the Guacamole connection of a server.
+
+    The stored password is encrypted, so a supplied password always counts as changed.
+    """
+    return {
+        field for field, value in update_data.items()
+        if field in GUACAMOLE_SYNCED_FIELDS and (field == "password" or server.get(field) != value)
+    }
+
+class GuacamoleTokens:
+    """Admin tokens for a batch of calls, one login per Guacamole backend"""
+
+    def __init__(self):
+        self._logins = {}
+
+    async def get(self, base_url: str) -> Optional[str]:
+        if base_url not in self._logins:
+            self._logins[base_url] = asyncio.ensure_future(authenticate_guacamole("guacadmin", "guacadmin", base_url))
+        auth_data = await self._logins[base_url]
+        if not auth_data or "authToken" not in auth_data:
+            return None
+        return auth_data["authToken"]
+
+class GuacamoleSync:
+    """Coalescing, batched propagation of server edits to Guacamole.
+
+    Edits are queued per server for a short window, so a burst of updates to the
+    same connection becomes one upstream call with the latest state. Each window
+    is flushed with one login per backend and at most `concurrency` calls in flight.
+    Guacamole only accepts whole connection objects, so the diff decides whether
+    and when a connection is pushed and the payload is rebuilt from local state.
+
+    A failed push marks the server guacamole_sync_pending and is retried with
+    exponential backoff; after `max_retries` it is left to the reconcile job.
+    """
+
+    def __init__(self, delay: float = 0.5, concurrency: int = 8, max_retries: int = 5, max_backoff: float = 60.0):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.pending = {}
+        self.attempts = {}
+        self._retries = {}
+        self._task: Optional[asyncio.Task] = None
+        self._sleeping = False
+
+    def schedule(self, server_id: str, fields: set):
+        self.pending.setdefault(server_id, set()).update(fields)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    def _retry(self, server_id: str, fields: set):
+        self._retries.pop(server_id, None)
+        self.schedule(server_id, fields)
+
+    async def _flush_later(self):
+        # Edits scheduled while a flush is in progress go out in the next window
+        while self.pending:
+            self._sleeping = True
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self._sleeping = False
+            await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        tokens = GuacamoleTokens()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def push(server_id: str, fields: set):
+            async with semaphore:
+                server = await storage.get_server(server_id)
+                credentials = await load_server_credentials(server_id)
+                if not server or not server.get("guacamole_connection_id") or not credentials:
+                    self.attempts.pop(server_id, None)
+                    return
+                auth_token = await tokens.get(guacamole_backend(server))
+                if auth_token and await update_guacamole_connection(auth_token, RDPServer(**server), credentials):
+                    self.attempts.pop(server_id, None)
+                    if server.get("guacamole_sync_pending"):
+                        await storage.update_server(server_id, {"guacamole_sync_pending": False})
+                    return
+                await self._failed(server, fields)
+
+        await asyncio.gather(*(push(server_id, fields) for server_id, fields in batch.items()))
+
+    async def _failed(self, server: dict, fields: set):
+        server_id = server["id"]
+        if not server.get("guacamole_sync_pending"):
+            await storage.update_server(server_id, {"guacamole_sync_pending": True})
+        attempt = self.attempts.get(server_id, 0) + 1
+        if attempt > self.max_retries:
+            self.attempts.pop(server_id, None)
+            logging.error(f"Failed to propagate {sorted(fields)} of server {server_id} to Guacamole, left to reconcile")
+            return
+        self.attempts[server_id] = attempt
+        backoff = min(self.max_backoff, self.delay * 2 ** attempt)
+        logging.warning(f"Failed to propagate {sorted(fields)} of server {server_id} to Guacamole, retrying in {backoff:.1f}s")
+        if server_id not in self._retries:
+            self._retries[server_id] = asyncio.get_running_loop().call_later(backoff, self._retry, server_id, fields)
+
+    async def close(self):
+        """Push everything queued; pending retries stay flagged for the reconcile job"""
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        if self._task is not None and not self._task.done():
+            if self._sleeping:
+                self._task.cancel()
+            try:
+                # A flush in progress holds edits already taken out of pending
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+guacamole_sync = GuacamoleSync()
+
+class GuacamoleLoads:
+    """Number of RDP servers on each backend, kept in memory for placement.
+
+    The counts are re-aggregated from storage at most every `max_age` seconds and
+    adjusted in between as this worker places, moves and removes servers, so
+    creating a server does not group the whole collection. Other workers' changes
+    show up at the next refresh, which the placement slack absorbs.
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self.counts: Optional[dict] = None
+        self.refreshed_at = 0.0
+
+    async def get(self, fresh: bool = False) -> dict:
+        if fresh or self.counts is None or time.monotonic() - self.refreshed_at > self.max_age:
+            counts = {}
+            for url, count in (await storage.count_servers_by_guacamole_url()).items():
+                backend = guacamole_pool.resolve(url)
+                counts[backend] = counts.get(backend, 0) + count
+            self.counts, self.refreshed_at = counts, time.monotonic()
+        return {**{url: 0 for url in guacamole_pool.urls}, **self.counts}
+
+    def add(self, url: str, count: int = 1):
+        if self.counts is not None:
+            self.counts[url] = self.counts.get(url, 0) + count
+
+guacamole_loads = GuacamoleLoads()
+
+async def guacamole_backend_loads(fresh: bool = False) -> dict:
+    """Number of RDP servers placed on each backend of the pool"""
+    return await guacamole_loads.get(fresh)
+
+async def iter_all_servers():
+    cursor = None
+    while True:
+        servers = await storage.find_servers(sort="created_at", cursor=cursor, limit=500)
+        for server in servers:
+            yield server
+        if len(servers) < 500:
+            return
+        cursor = encode_cursor(servers[-1], "created_at")
+
+async def rebalance_guacamole_connections(dry_run: bool = False, concurrency: int = 8) -> dict:
+    """Move connections to the backend consistent hashing assigns them.
+
+    Meant to be run after backends are added to or removed from GUACAMOLE_URLS.
+    A server moves when its backend left the pool, or when its hashed backend can
+    take it without going over the placement slack. Each move creates the
+    connection on the new backend before deleting it from the old one. Servers
+    with open sessions are not moved, since deleting their connection would cut
+    the sessions off; they are reported as busy and picked up by a later run.
+    """
+    loads = await guacamole_backend_loads(fresh=True)
+    moves, busy = [], []
+    async for server in iter_all_servers():
+        current = guacamole_backend(server)
+        target = guacamole_pool.hashed_url(server["id"])
+        if current == target:
+            continue
+        if current not in guacamole_pool.urls:
+            target = guacamole_pool.place(server["id"], loads)
+        elif guacamole_pool.place(server["id"], loads) != target:
+            continue
+        if await storage.count_connections(server["id"], [RDPStatus.ACTIVE, RDPStatus.CONNECTING]):
+            busy.append(server["id"])
+            continue
+        loads[current] -= 1
+        loads[target] = loads.get(target, 0) + 1
+        moves.append((server, current, target))
+
+    result = {"planned": len(moves), "moved": 0, "failed": 0, "busy": busy,
+              "moves": [{"server_id": server["id"], "from": current, "to": target} for server, current, target in moves]}
+    if dry_run:
+        return result
+
+    tokens = GuacamoleTokens()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def move(server: dict, current: str, target: str):
+        async with semaphore:
+            credentials = await load_server_credentials(server["id"])
+            auth_token = await tokens.get(target)
+            moved = RDPServer(**{**server, "guacamole_url": target})
+            guac_connection = None
+            if credentials and auth_token:
+                guac_connection = await create_guacamole_connection(auth_token, moved, credentials)
+            if not guac_connection or "identifier" not in guac_connection:
+                result["failed"] += 1
+                return
+            await storage.update_server(server["id"], {
+                "guacamole_url": target,
+                "guacamole_connection_id": guac_connection["identifier"],
+                "updated_at": datetime.utcnow(),
+            })
+            guacamole_loads.add(current, -1)
+            guacamole_loads.add(target)
+            if server.get("guacamole_connection_id"):
+                old_token = await tokens.get(current)
+                if old_token:
+                    await delete_guacamole_connection(old_token, server["guacamole_connection_id"], current)
+            result["moved"] += 1
+
+    await asyncio.gather(*(move(*planned) for planned in moves))
+    return result
+
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
     return {"message": "RDP Manager API with Guacamole is running"}
 
 # Guacamole authentication endpoint
+async def guacamole_backend_for(server_id: Optional[str]) -> str:
+    if not server_id:
+        return guacamole_pool.default_url
+    server = await storage.get_server(server_id)
+    if not server:
+        raise HTTPException(status_code=404, detail="RDP Server not found")
+    return guacamole_backend(server)
+
 @api_router.post("/guacamole/auth")
-async def guacamole_auth(credentials: GuacamoleCredentials):
-    """Authenticate with Guacamole"""
-    token_data = await authenticate_guacamole(credentials.username, credentials.password)
+async def guacamole_auth(credentials: GuacamoleCredentials, server_id: Optional[str] = None):
+    """Authenticate with Guacamole, on the backend of server_id if given"""
+    base_url = await guacamole_backend_for(server_id)
+    token_data = await authenticate_guacamole(credentials.username, credentials.password, base_url)
     if token_data:
         return token_data
     else:
@@ -184,12 +558,13 @@ async def guacamole_auth(credentials: GuacamoleCredentials):
 
 # Guacamole proxy endpoints
 @api_router.post("/guacamole/tokens")
-async def guacamole_tokens(username: str = Form(...), password: str = Form(...)):
-    """Proxy authentication requests to Guacamole"""
+async def guacamole_tokens(username: str = Form(...), password: str = Form(...), server_id: Optional[str] = Form(None)):
+    """Proxy authentication requests to Guacamole, on the backend of server_id if given"""
+    base_url = await guacamole_backend_for(server_id)
     try:
         async with httpx.AsyncClient() as client:
             response = await client.post(
-                f"{GUACAMOLE_URL}/guacamole/api/tokens",
+                f"{base_url}/guacamole/api/tokens",
                 data={"username": username, "password": password},
                 timeout=30.0
             )
@@ -202,72 +577,137 @@ async def guacamole_tokens(username: str = Form(...), password: str = Form(...))
 
 # RDP Server endpoints
 @api_router.post("/rdp-servers", response_model=RDPServer)
-async def create_rdp_server(server: RDPServerCreate):
-    server_dict = server.dict()
+async def create_rdp_server(
+    server: RDPServerCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER),
+):
+    return await run_idempotent(
+        "POST /api/rdp-servers", idempotency_key, server, response,
+        lambda: provision_rdp_server(server)
+    )
+
+async def provision_rdp_server(server: RDPServerCreate):
+    server_dict = server.dict(exclude={"password"})
     server_obj = RDPServer(**server_dict)
+    credentials = RDPCredentials(server_id=server_obj.id, password=server.password)
+    server_obj.guacamole_url = guacamole_pool.place(server_obj.id, await guacamole_backend_loads())
     
     # Try to create connection in Guacamole
     # First authenticate
-    auth_data = await authenticate_guacamole("guacadmin", "guacadmin")
+    auth_data = await authenticate_guacamole("guacadmin", "guacadmin", server_obj.guacamole_url)
     if auth_data and "authToken" in auth_data:
-        guac_connection = await create_guacamole_connection(auth_data["authToken"], server_obj)
+        guac_connection = await create_guacamole_connection(auth_data["authToken"], server_obj, credentials)
         if guac_connection and "identifier" in guac_connection:
             server_obj.guacamole_connection_id = guac_connection["identifier"]
     
-    await db.rdp_servers.insert_one(server_obj.dict())
+    await store_server_credentials(server_obj.id, credentials.password)
+    await storage.insert_server(server_obj.dict())
+    guacamole_loads.add(server_obj.guacamole_url)
+    session_events.record(
+        SessionEventType.PROVISION, server_obj.id,
+        guacamole_connection_id=server_obj.guacamole_connection_id
+    )
     return server_obj
 
 @api_router.get("/rdp-servers", response_model=List[RDPServer])
-async def get_rdp_servers():
-    servers = await db.rdp_servers.find().to_list(1000)
+async def get_rdp_servers(
+    response: Response,
+    q: Optional[str] = None,
+    os_type: Optional[OSType] = None,
+    status: Optional[RDPStatus] = None,
+    host: Optional[str] = None,
+    sort: str = "created_at",
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+):
+    """List RDP servers with search, filters and cursor pagination.
+
+    The cursor of the next page, if any, is returned in the X-Next-Cursor header.
+    """
+    servers = await storage.find_servers(q, os_type, status, host, sort, cursor, limit + 1)
+    if len(servers) > limit:
+        servers = servers[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(servers[-1], sort.lstrip("-"))
     return [RDPServer(**server) for server in servers]
 
 @api_router.get("/rdp-servers/{server_id}", response_model=RDPServer)
 async def get_rdp_server(server_id: str):
-    server = await db.rdp_servers.find_one({"id": server_id})
+    server = await storage.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="RDP Server not found")
     return RDPServer(**server)
 
+@api_router.put("/rdp-servers/bulk", response_model=List[RDPServer])
+async def bulk_update_rdp_servers(server_updates: List[RDPServerBulkUpdate]):
+    """Apply several server edits, propagated to Guacamole as one batch"""
+    for server_update in server_updates:
+        if not await storage.get_server(server_update.id):
+            raise HTTPException(status_code=404, detail=f"RDP Server {server_update.id} not found")
+    
+    servers = []
+    for server_update in server_updates:
+        servers.append(await apply_rdp_server_update(server_update.id, server_update))
+    return servers
+
 @api_router.put("/rdp-servers/{server_id}", response_model=RDPServer)
 async def update_rdp_server(server_id: str, server_update: RDPServerUpdate):
-    server = await db.rdp_servers.find_one({"id": server_id})
+    return await apply_rdp_server_update(server_id, server_update)
+
+async def apply_rdp_server_update(server_id: str, server_update: RDPServerUpdate):
+    server = await storage.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="RDP Server not found")
     
-    update_data = server_update.dict(exclude_unset=True)
+    update_data = server_update.dict(exclude_unset=True, exclude={"id"})
+    changed_fields = diff_guacamole_fields(server, update_data)
+    password = update_data.pop("password", None)
+    if password is not None:
+        await store_server_credentials(server_id, password)
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
-        await db.rdp_servers.update_one(
-            {"id": server_id}, 
-            {"$set": update_data}
-        )
+        await storage.update_server(server_id, update_data)
     
-    updated_server = await db.rdp_servers.find_one({"id": server_id})
+    if changed_fields and server.get("guacamole_connection_id"):
+        guacamole_sync.schedule(server_id, changed_fields)
+    
+    updated_server = await storage.get_server(server_id)
     return RDPServer(**updated_server)
 
 @api_router.delete("/rdp-servers/{server_id}")
 async def delete_rdp_server(server_id: str):
-    server = await db.rdp_servers.find_one({"id": server_id})
+    server = await storage.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="RDP Server not found")
     
     # Delete from Guacamole if exists
     if server.get("guacamole_connection_id"):
-        auth_data = await authenticate_guacamole("guacadmin", "guacadmin")
+        base_url = guacamole_backend(server)
+        auth_data = await authenticate_guacamole("guacadmin", "guacadmin", base_url)
         if auth_data and "authToken" in auth_data:
-            await delete_guacamole_connection(auth_data["authToken"], server["guacamole_connection_id"])
+            await delete_guacamole_connection(auth_data["authToken"], server["guacamole_connection_id"], base_url)
     
-    result = await db.rdp_servers.delete_one({"id": server_id})
-    if result.deleted_count == 0:
+    if not await storage.delete_server(server_id):
         raise HTTPException(status_code=404, detail="RDP Server not found")
+    guacamole_loads.add(guacamole_backend(server), -1)
+    await storage.delete_credentials(server_id)
     return {"message": "RDP Server deleted successfully"}
 
 # RDP Connection endpoints
 @api_router.post("/connections", response_model=RDPConnection)
-async def create_connection(connection: ConnectionCreate):
+async def create_connection(
+    connection: ConnectionCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER),
+):
+    return await run_idempotent(
+        "POST /api/connections", idempotency_key, connection, response,
+        lambda: open_connection(connection)
+    )
+
+async def open_connection(connection: ConnectionCreate):
     # Check if server exists
-    server = await db.rdp_servers.find_one({"id": connection.server_id})
+    server = await storage.get_server(connection.server_id)
     if not server:
         raise HTTPException(status_code=404, detail="RDP Server not found")
     
@@ -278,59 +718,152 @@ async def create_connection(connection: ConnectionCreate):
         session_id=session_id,
         guacamole_session_id=server.get("guacamole_connection_id")
     )
-    await db.rdp_connections.insert_one(connection_obj.dict())
+    await storage.insert_connection(connection_obj.dict())
     
     # Update server status
-    await db.rdp_servers.update_one(
-        {"id": connection.server_id},
-        {"$set": {"status": RDPStatus.ACTIVE, "updated_at": datetime.utcnow()}}
+    await storage.update_server(
+        connection.server_id,
+        {"status": RDPStatus.ACTIVE, "updated_at": datetime.utcnow()}
     )
     
+    session_events.record(SessionEventType.CONNECT, connection.server_id, connection_obj.id)
     return connection_obj
 
 @api_router.get("/connections", response_model=List[RDPConnection])
 async def get_connections():
-    connections = await db.rdp_connections.find().to_list(1000)
+    connections = await storage.list_connections(limit=1000)
     return [RDPConnection(**connection) for connection in connections]
 
 @api_router.get("/connections/active", response_model=List[RDPConnection])
 async def get_active_connections():
-    connections = await db.rdp_connections.find({
-        "status": {"$in": [RDPStatus.ACTIVE, RDPStatus.CONNECTING]}
-    }).to_list(1000)
+    connections = await storage.list_connections([RDPStatus.ACTIVE, RDPStatus.CONNECTING], limit=1000)
     return [RDPConnection(**connection) for connection in connections]
 
 @api_router.delete("/connections/{connection_id}")
 async def end_connection(connection_id: str):
-    connection = await db.rdp_connections.find_one({"id": connection_id})
+    connection = await storage.get_connection(connection_id)
     if not connection:
         raise HTTPException(status_code=404, detail="Connection not found")
     
     # Update connection status
-    await db.rdp_connections.update_one(
-        {"id": connection_id},
-        {"$set": {"status": RDPStatus.INACTIVE, "ended_at": datetime.utcnow()}}
+    await storage.update_connection(
+        connection_id,
+        {"status": RDPStatus.INACTIVE, "ended_at": datetime.utcnow()}
     )
     
     # Update server status if no other active connections
-    active_connections = await db.rdp_connections.count_documents({
-        "server_id": connection["server_id"],
-        "status": {"$in": [RDPStatus.ACTIVE, RDPStatus.CONNECTING]}
-    })
-    
-    if active_connections == 0:
-        await db.rdp_servers.update_one(
-            {"id": connection["server_id"]},
-            {"$set": {"status": RDPStatus.INACTIVE, "updated_at": datetime.utcnow()}}
-        )
+    await refresh_server_status(connection["server_id"])
     
+    session_events.record(SessionEventType.DISCONNECT, connection["server_id"], connection_id)
     return {"message": "Connection ended successfully"}
 
+async def refresh_server_status(server_id: str, current_status: Optional[str] = None) -> bool:
+    """Set a server active or inactive from its open connections; returns whether it changed.
+
+    Without current_status only the move to inactive is applied, which is all that
+    ending a session can cause.
+    """
+    active_connections = await storage.count_connections(
+        server_id, [RDPStatus.ACTIVE, RDPStatus.CONNECTING]
+    )
+    if active_connections and current_status not in (None, RDPStatus.ACTIVE):
+        status = RDPStatus.ACTIVE
+    elif not active_connections and current_status in (None, RDPStatus.ACTIVE):
+        status = RDPStatus.INACTIVE
+    else:
+        return False
+    await storage.update_server(server_id, {"status": status, "updated_at": datetime.utcnow()})
+    return True
+
+# Maintenance jobs run by the scheduler
+OPEN_STATUSES = [RDPStatus.ACTIVE, RDPStatus.CONNECTING]
+
+async def cleanup_stale_sessions():
+    """End sessions left active or connecting for longer than STALE_SESSION_HOURS"""
+    cutoff = datetime.utcnow() - timedelta(hours=STALE_SESSION_HOURS)
+    ended, servers = 0, set()
+    async for batch in storage.iter_connections_started_before(OPEN_STATUSES, cutoff):
+        for connection in batch:
+            await storage.update_connection(
+                connection["id"],
+                {"status": RDPStatus.INACTIVE, "ended_at": datetime.utcnow()}
+            )
+            session_events.record(SessionEventType.DISCONNECT, connection["server_id"], connection["id"], reason="stale")
+            servers.add(connection["server_id"])
+        ended += len(batch)
+    for server_id in servers:
+        await refresh_server_status(server_id)
+    return {"ended": ended}
+
+async def recompute_server_statuses():
+    """Fix server statuses that drifted from their open connections.
+
+    One aggregation counts open connections per server; only servers whose
+    status disagrees with it are written, in one bulk update per new and
+    observed status. The update only applies where the status is still the one
+    read and the server was not updated since the aggregation started, so a
+    session started or ended meanwhile is not overwritten with a stale status.
+    """
+    snapshot = datetime.utcnow()
+    open_servers = set(await storage.count_connections_by_server(OPEN_STATUSES))
+    drifted = {}
+    async for server in iter_all_servers():
+        status = server.get("status")
+        if server["id"] in open_servers and status != RDPStatus.ACTIVE:
+            drifted.setdefault((RDPStatus.ACTIVE, status), []).append(server["id"])
+        elif server["id"] not in open_servers and status == RDPStatus.ACTIVE:
+            drifted.setdefault((RDPStatus.INACTIVE, status), []).append(server["id"])
+    now = datetime.utcnow()
+    changed = 0
+    for (new_status, observed_status), server_ids in drifted.items():
+        changed += await storage.update_servers(
+            server_ids, {"status": new_status, "updated_at": now},
+            status=observed_status, updated_before=snapshot
+        )
+    return {"changed": changed}
+
+async def reconcile_guacamole_connections(concurrency: int = 8):
+    """Retry provisioning servers whose Guacamole connection could not be created,
+    and re-push edits whose propagation to Guacamole failed"""
+    missing, out_of_sync = [], []
+    async for server in iter_all_servers():
+        if not server.get("guacamole_connection_id"):
+            missing.append(server)
+        elif server.get("guacamole_sync_pending"):
+            out_of_sync.append(server)
+    for server in out_of_sync:
+        guacamole_sync.schedule(server["id"], set(GUACAMOLE_SYNCED_FIELDS))
+    tokens = GuacamoleTokens()
+    semaphore = asyncio.Semaphore(concurrency)
+    result = {"missing": len(missing), "provisioned": 0, "resync_queued": len(out_of_sync)}
+
+    async def provision(server: dict):
+        async with semaphore:
+            credentials = await load_server_credentials(server["id"])
+            auth_token = await tokens.get(guacamole_backend(server))
+            if not credentials or not auth_token:
+                return
+            guac_connection = await create_guacamole_connection(auth_token, RDPServer(**server), credentials)
+            if guac_connection and "identifier" in guac_connection:
+                await storage.update_server(server["id"], {
+                    "guacamole_connection_id": guac_connection["identifier"],
+                    "guacamole_url": guacamole_backend(server),
+                    "updated_at": datetime.utcnow(),
+                })
+                result["provisioned"] += 1
+
+    await asyncio.gather(*(provision(server) for server in missing))
+    return result
+
+scheduler.add_job("cleanup-stale-sessions", cleanup_stale_sessions, interval=300)
+scheduler.add_job("recompute-server-statuses", recompute_server_statuses, interval=60)
+scheduler.add_job("reconcile-guacamole-connections", reconcile_guacamole_connections, interval=600)
+
 # Get Guacamole connection URL
 @api_router.get("/guacamole/connection/{server_id}")
 async def get_guacamole_connection_url(server_id: str):
     """Get Guacamole connection URL for a server"""
-    server = await db.rdp_servers.find_one({"id": server_id})
+    server = await storage.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="RDP Server not found")
     
@@ -339,11 +872,113 @@ async def get_guacamole_connection_url(server_id: str):
     
     # Return connection details for frontend
     return {
-        "guacamole_url": f"{GUACAMOLE_URL}/guacamole",
+        "guacamole_url": f"{guacamole_backend(server)}/guacamole",
         "connection_id": server["guacamole_connection_id"],
         "server_name": server["name"]
     }
 
+# Session analytics over the connection history
+# The concurrency array holds one int64 per resolution bucket, so this caps it at 8 MB per query
+ANALYTICS_MAX_BUCKETS = 1_000_000
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; convert offset-aware query parameters to match"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def analytics_window(since: Optional[datetime], until: Optional[datetime]):
+    until = naive_utc(until) or datetime.utcnow()
+    since = naive_utc(since) or until - timedelta(days=90)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    return since, until
+
+@api_router.get("/analytics/sessions")
+async def get_session_analytics(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    resolution_seconds: int = Query(60, ge=1),
+    batch_size: int = Query(5000, ge=100, le=50000),
+):
+    """Duration percentiles, peak concurrency and per-server usage of sessions started in [since, until)"""
+    since, until = analytics_window(since, until)
+    min_resolution = math.ceil((until - since).total_seconds() / ANALYTICS_MAX_BUCKETS)
+    if resolution_seconds < min_resolution:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Time range too large for this resolution, use resolution_seconds >= {min_resolution}"
+        )
+    batches = storage.iter_connection_history(since, until, batch_size)
+    return await analytics.session_stats(batches, since, until, resolution_seconds)
+
+@api_router.get("/analytics/sessions/export")
+async def export_session_history(
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = Query(5000, ge=100, le=50000),
+):
+    """Stream the connection history as CSV or Parquet, one batch at a time"""
+    since, until = analytics_window(since, until)
+    batches = storage.iter_connection_history(since, until, batch_size)
+    filename = f"sessions-{since:%Y%m%d}-{until:%Y%m%d}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
+        return StreamingResponse(analytics.export_parquet(batches), media_type="application/vnd.apache.parquet", headers=headers)
+    return StreamingResponse(analytics.export_csv(batches), media_type="text/csv", headers=headers)
+
+@api_router.get("/session-events/stats")
+async def get_session_event_stats():
+    """Counters of the buffered session event log"""
+    return session_events.stats()
+
+@api_router.get("/metrics/event-loop")
+async def get_event_loop_metrics():
+    """Event-loop scheduling delay and recently traced stalls"""
+    return loop_monitor.stats()
+
+@api_router.get("/metrics/jobs")
+async def get_job_metrics():
+    """Run counts and durations of the scheduled maintenance jobs in this worker"""
+    return {"owner": scheduler.owner, "enabled": SCHEDULER_ENABLED, "jobs": scheduler.stats()}
+
+# Admin endpoints for request profiles
+def require_admin_token(token: Optional[str]):
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """List the stored request profiles, newest first"""
+    require_admin_token(x_admin_token)
+    return await asyncio.to_thread(profile_store.list)
+
+@api_router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Get a request profile as collapsed stacks, ready for flamegraph.pl or speedscope"""
+    require_admin_token(x_admin_token)
+    folded = await asyncio.to_thread(profile_store.read, profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return folded
+
+# Admin endpoints for the Guacamole backend pool
+@api_router.get("/admin/guacamole/backends")
+async def get_guacamole_backends(x_admin_token: Optional[str] = Header(None)):
+    """Number of RDP servers placed on each Guacamole backend"""
+    require_admin_token(x_admin_token)
+    loads = await guacamole_backend_loads(fresh=True)
+    return [{"url": url, "servers": count, "in_pool": url in guacamole_pool.urls} for url, count in loads.items()]
+
+@api_router.post("/admin/guacamole/rebalance")
+async def rebalance_guacamole_backends(dry_run: bool = True, x_admin_token: Optional[str] = Header(None)):
+    """Move connections after backends were added or removed, planning only unless dry_run=false"""
+    require_admin_token(x_admin_token)
+    return await rebalance_guacamole_connections(dry_run=dry_run)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -353,6 +988,15 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
+)
+
+app.add_middleware(
+    ProfilingMiddleware,
+    store=profile_store,
+    secret=PROFILING_SECRET,
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    max_signature_age=float(os.environ.get('PROFILE_SIGNATURE_MAX_AGE', '300')),
 )
 
 # Configure logging
@@ -362,6 +1006,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("startup")
+async def prepare_database():
+    await storage.prepare()
+    await storage.idempotency_keys.create_indexes(idempotency_store.indexes)
+    await storage.session_events.create_index([("server_id", ASCENDING), ("timestamp", ASCENDING)])
+    await migrate_inline_credentials()
+    session_events.start()
+
+@app.on_event("startup")
+async def start_scheduler():
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await scheduler.stop()
+    await guacamole_sync.close()
+    await session_events.stop()
+    await loop_monitor.stop()
+    await storage.close()
@@ -0,0 +1,729 @@
+import base64
+import json
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING, IndexModel, TEXT
+from pymongo.errors import DuplicateKeyError
+
+
+# Indexes backing the server-side search and filtering of rdp_servers
+RDP_SERVER_SORT_FIELDS = ("name", "host", "created_at", "updated_at")
+
+RDP_SERVER_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True),
+    IndexModel([("name", TEXT), ("host", TEXT), ("description", TEXT)], name="rdp_servers_text"),
+    IndexModel([("os_type", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("os_type", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    # Backs the per-backend server counts used for Guacamole placement
+    IndexModel([("guacamole_url", ASCENDING)]),
+] + [IndexModel([(field, ASCENDING), ("id", ASCENDING)]) for field in RDP_SERVER_SORT_FIELDS]
+
+RDP_CONNECTION_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True),
+    IndexModel([("server_id", ASCENDING), ("status", ASCENDING)]),
+    IndexModel([("status", ASCENDING)]),
+    IndexModel([("started_at", ASCENDING)]),
+]
+
+# Fields of rdp_connections read by the session analytics
+CONNECTION_HISTORY_FIELDS = ("id", "server_id", "status", "started_at", "ended_at")
+
+
+def encode_cursor(server: dict, sort_field: str) -> str:
+    value = server[sort_field]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, server["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str, sort_field: str):
+    try:
+        value, server_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort_field in ("created_at", "updated_at"):
+            value = datetime.fromisoformat(value)
+        return value, server_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_sort(sort: str) -> Tuple[str, int]:
+    sort_field = sort.lstrip("-")
+    if sort_field not in RDP_SERVER_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort_field}'")
+    return sort_field, DESCENDING if sort.startswith("-") else ASCENDING
+
+def build_rdp_server_query(
+    q: Optional[str] = None,
+    os_type: Optional[str] = None,
+    status: Optional[str] = None,
+    host: Optional[str] = None,
+    sort: str = "created_at",
+    cursor: Optional[str] = None,
+) -> Tuple[dict, list]:
+    """Build the Mongo filter and sort spec for a page of RDP servers"""
+    sort_field, direction = parse_sort(sort)
+
+    conditions = []
+    if q:
+        conditions.append({"$text": {"$search": q}})
+    if os_type:
+        conditions.append({"os_type": os_type})
+    if status:
+        conditions.append({"status": status})
+    if host:
+        # An anchored, case-sensitive regex is served by the host index
+        conditions.append({"host": {"$regex": f"^{re.escape(host)}"}})
+    if cursor:
+        value, server_id = decode_cursor(cursor, sort_field)
+        after = "$gt" if direction == ASCENDING else "$lt"
+        conditions.append({"$or": [
+            {sort_field: {after: value}},
+            {sort_field: value, "id": {after: server_id}},
+        ]})
+
+    query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+    return query, [(sort_field, direction), ("id", direction)]
+
+
+class Storage(ABC):
+    """Persistence used by the route handlers.
+
+    Documents are plain dicts shaped like the API models. session_events and
+    idempotency_keys are exposed as collections with the subset of the Motor
+    collection API used by SessionEventLog and IdempotencyStore.
+    """
+
+    session_events = None
+    idempotency_keys = None
+
+    async def prepare(self):
+        """Create indexes or load persisted data before serving requests"""
+
+    async def close(self):
+        """Release connections and files"""
+
+    async def migrate_inline_credentials(self, encrypt) -> int:
+        """Move passwords stored on server documents into the credentials store"""
+        return 0
+
+    # RDP servers
+    @abstractmethod
+    async def insert_server(self, server: dict): ...
+
+    @abstractmethod
+    async def get_server(self, server_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def find_servers(self, q: Optional[str] = None, os_type: Optional[str] = None,
+                           status: Optional[str] = None, host: Optional[str] = None,
+                           sort: str = "created_at", cursor: Optional[str] = None,
+                           limit: int = 1000) -> List[dict]: ...
+
+    @abstractmethod
+    async def update_server(self, server_id: str, fields: dict) -> bool: ...
+
+    @abstractmethod
+    async def update_servers(self, server_ids: List[str], fields: dict, status: Optional[str] = None,
+                             updated_before: Optional[datetime] = None) -> int:
+        """Set fields on several servers at once; returns how many matched.
+
+        With status and updated_before, only servers still in that status and not
+        updated since updated_before are written, so an update computed from an
+        earlier read does not overwrite a newer change.
+        """
+
+    @abstractmethod
+    async def delete_server(self, server_id: str) -> bool: ...
+
+    @abstractmethod
+    async def count_servers_by_guacamole_url(self) -> Dict[Optional[str], int]: ...
+
+    # Encrypted credentials, keyed by server id
+    @abstractmethod
+    async def set_credentials(self, server_id: str, fields: dict): ...
+
+    @abstractmethod
+    async def get_credentials(self, server_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def delete_credentials(self, server_id: str): ...
+
+    # RDP connections
+    @abstractmethod
+    async def insert_connection(self, connection: dict): ...
+
+    @abstractmethod
+    async def get_connection(self, connection_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def list_connections(self, statuses: Optional[Iterable[str]] = None, limit: int = 1000) -> List[dict]: ...
+
+    @abstractmethod
+    async def update_connection(self, connection_id: str, fields: dict) -> bool: ...
+
+    @abstractmethod
+    async def count_connections(self, server_id: str, statuses: Iterable[str]) -> int: ...
+
+    @abstractmethod
+    async def count_connections_by_server(self, statuses: Iterable[str]) -> Dict[str, int]:
+        """Number of connections in statuses per server, for servers that have any"""
+
+    @abstractmethod
+    def iter_connections_started_before(self, statuses: Iterable[str], started_before: datetime,
+                                        batch_size: int = 500) -> AsyncIterator[List[dict]]:
+        """Connections in statuses started before started_before, oldest first, in batches"""
+
+    # Scheduler leases, one per job name
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """Take or extend the lease on name for owner, unless someone else holds an unexpired one"""
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str): ...
+
+    @abstractmethod
+    def iter_connection_history(self, since: datetime, until: datetime,
+                                batch_size: int = 5000) -> AsyncIterator[List[dict]]:
+        """Connections started in [since, until), in batches of at most batch_size"""
+
+
+class MotorStorage(Storage):
+    def __init__(self, db):
+        self.db = db
+        self.session_events = db.session_events
+        self.idempotency_keys = db.idempotency_keys
+
+    async def prepare(self):
+        await self.db.rdp_servers.create_indexes(RDP_SERVER_INDEXES)
+        await self.db.rdp_connections.create_indexes(RDP_CONNECTION_INDEXES)
+        await self.db.rdp_credentials.create_index("server_id", unique=True)
+
+    async def close(self):
+        self.db.client.close()
+
+    async def migrate_inline_credentials(self, encrypt) -> int:
+        migrated = 0
+        async for server in self.db.rdp_servers.find({"password": {"$exists": True}}, {"id": 1, "password": 1}):
+            await self.set_credentials(server["id"], {"password": encrypt(server["password"]), "updated_at": datetime.utcnow()})
+            await self.db.rdp_servers.update_one({"id": server["id"]}, {"$unset": {"password": ""}})
+            migrated += 1
+        return migrated
+
+    async def insert_server(self, server: dict):
+        await self.db.rdp_servers.insert_one(dict(server))
+
+    async def get_server(self, server_id: str) -> Optional[dict]:
+        return await self.db.rdp_servers.find_one({"id": server_id}, {"_id": 0})
+
+    async def find_servers(self, q=None, os_type=None, status=None, host=None, sort="created_at", cursor=None, limit=1000):
+        query, sort_spec = build_rdp_server_query(q, os_type, status, host, sort, cursor)
+        return await self.db.rdp_servers.find(query, {"_id": 0}).sort(sort_spec).limit(limit).to_list(limit)
+
+    async def update_server(self, server_id: str, fields: dict) -> bool:
+        result = await self.db.rdp_servers.update_one({"id": server_id}, {"$set": fields})
+        return result.matched_count > 0
+
+    async def update_servers(self, server_ids, fields, status=None, updated_before=None) -> int:
+        query = {"id": {"$in": list(server_ids)}}
+        if status is not None:
+            query["status"] = status
+        if updated_before is not None:
+            query["updated_at"] = {"$lte": updated_before}
+        result = await self.db.rdp_servers.update_many(query, {"$set": fields})
+        return result.matched_count
+
+    async def delete_server(self, server_id: str) -> bool:
+        result = await self.db.rdp_servers.delete_one({"id": server_id})
+        return result.deleted_count > 0
+
+    async def count_servers_by_guacamole_url(self) -> Dict[Optional[str], int]:
+        groups = self.db.rdp_servers.aggregate([{"$group": {"_id": "$guacamole_url", "count": {"$sum": 1}}}])
+        return {group["_id"]: group["count"] async for group in groups}
+
+    async def set_credentials(self, server_id: str, fields: dict):
+        await self.db.rdp_credentials.update_one({"server_id": server_id}, {"$set": fields}, upsert=True)
+
+    async def get_credentials(self, server_id: str) -> Optional[dict]:
+        return await self.db.rdp_credentials.find_one({"server_id": server_id}, {"_id": 0})
+
+    async def delete_credentials(self, server_id: str):
+        await self.db.rdp_credentials.delete_one({"server_id": server_id})
+
+    async def insert_connection(self, connection: dict):
+        await self.db.rdp_connections.insert_one(dict(connection))
+
+    async def get_connection(self, connection_id: str) -> Optional[dict]:
+        return await self.db.rdp_connections.find_one({"id": connection_id}, {"_id": 0})
+
+    async def list_connections(self, statuses=None, limit=1000) -> List[dict]:
+        query = {"status": {"$in": list(statuses)}} if statuses is not None else {}
+        return await self.db.rdp_connections.find(query, {"_id": 0}).to_list(limit)
+
+    async def update_connection(self, connection_id: str, fields: dict) -> bool:
+        result = await self.db.rdp_connections.update_one({"id": connection_id}, {"$set": fields})
+        return result.matched_count > 0
+
+    async def count_connections(self, server_id: str, statuses) -> int:
+        return await self.db.rdp_connections.count_documents({"server_id": server_id, "status": {"$in": list(statuses)}})
+
+    async def count_connections_by_server(self, statuses) -> Dict[str, int]:
+        groups = self.db.rdp_connections.aggregate([
+            {"$match": {"status": {"$in": list(statuses)}}},
+            {"$group": {"_id": "$server_id", "count": {"$sum": 1}}},
+        ])
+        return {group["_id"]: group["count"] async for group in groups}
+
+    async def iter_connections_started_before(self, statuses, started_before, batch_size=500):
+        cursor = self.db.rdp_connections.find(
+            {"status": {"$in": list(statuses)}, "started_at": {"$lt": started_before}}, {"_id": 0}
+        ).sort("started_at", ASCENDING).batch_size(batch_size)
+        batch = []
+        async for connection in cursor:
+            batch.append(connection)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.db.scheduler_leases.find_one_and_update(
+                {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds), "acquired_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The upsert collided with a lease held by another owner
+            return False
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        await self.db.scheduler_leases.delete_one({"_id": name, "owner": owner})
+
+    async def iter_connection_history(self, since, until, batch_size=5000):
+        projection = {field: 1 for field in CONNECTION_HISTORY_FIELDS}
+        projection["_id"] = 0
+        cursor = self.db.rdp_connections.find(
+            {"started_at": {"$gte": since, "$lt": until}}, projection
+        ).sort("started_at", ASCENDING).batch_size(batch_size)
+        batch = []
+        async for connection in cursor:
+            batch.append(connection)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict) and set(value) == {"$date"}:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+def _encode_document(document: dict) -> dict:
+    return {field: _encode_value(value) for field, value in document.items()}
+
+def _decode_document(document: dict) -> dict:
+    return {field: _decode_value(value) for field, value in document.items()}
+
+
+def _plain(value):
+    """Enum members hash by name, so index keys use their plain values"""
+    return getattr(value, "value", value)
+
+
+class MemoryJournal:
+    """Snapshot plus append-only log persistence for MemoryStorage.
+
+    Every mutation is appended to <path>.log as one JSON line. On load the
+    snapshot at <path> is read, the log replayed, and the result compacted into
+    a new snapshot so the log only ever holds changes since the last start.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.log_path = self.path.with_name(self.path.name + ".log")
+        self._log = None
+
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        tables: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        if self.path.exists():
+            for table, rows in json.loads(self.path.read_text()).items():
+                tables[table] = {key: _decode_document(row) for key, row in rows.items()}
+        if self.log_path.exists():
+            with self.log_path.open() as log:
+                for line in log:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if entry["op"] == "put":
+                        tables[entry["table"]][entry["key"]] = _decode_document(entry["doc"])
+                    else:
+                        tables[entry["table"]].pop(entry["key"], None)
+        return tables
+
+    def compact(self, tables: Dict[str, Dict[str, dict]]):
+        snapshot = {table: {key: _encode_document(row) for key, row in rows.items()} for table, rows in tables.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(json.dumps(snapshot))
+        temporary.replace(self.path)
+        self.close()
+        self._log = self.log_path.open("w")
+
+    def put(self, table: str, key: str, document: dict):
+        self._append({"op": "put", "table": table, "key": key, "doc": _encode_document(document)})
+
+    def delete(self, table: str, key: str):
+        self._append({"op": "del", "table": table, "key": key})
+
+    def _append(self, entry: dict):
+        if self._log is not None:
+            self._log.write(json.dumps(entry) + "\n")
+            self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class MemoryCollection:
+    """Dict-backed stand-in for the few Motor collection calls made on auxiliary collections.
+
+    Supports equality queries, $set updates, unique indexes and TTL indexes,
+    which is what SessionEventLog and IdempotencyStore need.
+    """
+
+    def __init__(self, name: str, journal: Optional[MemoryJournal] = None):
+        self.name = name
+        self.journal = journal
+        self.documents: Dict[str, dict] = {}
+        self.unique_fields: Optional[Tuple[str, ...]] = None
+        self.ttl: Optional[Tuple[str, int]] = None
+        self._next_expiry_check = 0.0
+        self._sequence = 0
+
+    async def create_indexes(self, indexes: List[IndexModel]):
+        for index in indexes:
+            document = index.document
+            fields = tuple(document["key"].keys())
+            if document.get("unique"):
+                self.unique_fields = fields
+            if "expireAfterSeconds" in document:
+                self.ttl = (fields[0], document["expireAfterSeconds"])
+
+    async def create_index(self, keys, **kwargs):
+        await self.create_indexes([IndexModel(keys, **kwargs)])
+
+    def _key(self, document: dict) -> str:
+        if self.unique_fields:
+            return json.dumps([document.get(field) for field in self.unique_fields])
+        if "id" in document:
+            return document["id"]
+        self._sequence += 1
+        return f"{time.time_ns()}-{self._sequence}"
+
+    def _matches(self, document: dict, query: dict) -> bool:
+        return all(document.get(field) == value for field, value in query.items())
+
+    def _expire(self):
+        now = time.monotonic()
+        if self.ttl is None or now < self._next_expiry_check:
+            return
+        self._next_expiry_check = now + 60
+        field, seconds = self.ttl
+        cutoff = datetime.utcnow().timestamp() - seconds
+        for key, document in list(self.documents.items()):
+            if isinstance(document.get(field), datetime) and document[field].timestamp() < cutoff:
+                self._remove(key)
+
+    def _store(self, key: str, document: dict):
+        self.documents[key] = document
+        if self.journal:
+            self.journal.put(self.name, key, document)
+
+    def _remove(self, key: str):
+        del self.documents[key]
+        if self.journal:
+            self.journal.delete(self.name, key)
+
+    async def insert_one(self, document: dict):
+        self._expire()
+        key = self._key(document)
+        if key in self.documents:
+            raise DuplicateKeyError(f"Duplicate key in {self.name}: {key}")
+        self._store(key, dict(document))
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True):
+        for document in documents:
+            await self.insert_one(document)
+
+    def _lookup(self, query: dict) -> Optional[str]:
+        """Key of the first document matching query; a dict lookup when the query covers the unique fields"""
+        if self.unique_fields and all(field in query for field in self.unique_fields):
+            key = self._key(query)
+            document = self.documents.get(key)
+            return key if document is not None and self._matches(document, query) else None
+        for key, document in self.documents.items():
+            if self._matches(document, query):
+                return key
+        return None
+
+    async def find_one(self, query: dict) -> Optional[dict]:
+        key = self._lookup(query)
+        return dict(self.documents[key]) if key is not None else None
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        key = self._lookup(query)
+        if key is not None:
+            self._store(key, {**self.documents[key], **update.get("$set", {})})
+        elif upsert:
+            await self.insert_one({**query, **update.get("$set", {})})
+
+    async def delete_one(self, query: dict):
+        key = self._lookup(query)
+        if key is not None:
+            self._remove(key)
+
+
+class MemoryStorage(Storage):
+    """In-process storage for tests, benchmarks and small edge deployments.
+
+    Servers, credentials and connections are dicts keyed by id, and connections
+    are also hash-indexed on (server_id, status) so status lookups and counts do
+    not scan. With a path, every change goes through a MemoryJournal and the data
+    survives restarts; without one everything is lost when the process exits.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.journal = MemoryJournal(path) if path else None
+        self.servers: Dict[str, dict] = {}
+        self.credentials: Dict[str, dict] = {}
+        self.connections: Dict[str, dict] = {}
+        self.connections_by_server_status: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self.leases: Dict[str, dict] = {}
+        self.session_events = MemoryCollection("session_events", self.journal)
+        # Idempotency keys are short-lived and deliberately not journaled
+        self.idempotency_keys = MemoryCollection("idempotency_keys")
+
+    async def prepare(self):
+        if not self.journal:
+            return
+        tables = self.journal.load()
+        self.servers = tables["rdp_servers"]
+        self.credentials = tables["rdp_credentials"]
+        self.session_events.documents = tables["session_events"]
+        self.connections = {}
+        self.connections_by_server_status.clear()
+        for connection in tables["rdp_connections"].values():
+            self._index_connection(connection)
+        self.journal.compact({
+            "rdp_servers": self.servers,
+            "rdp_credentials": self.credentials,
+            "rdp_connections": self.connections,
+            "session_events": self.session_events.documents,
+        })
+
+    async def close(self):
+        if self.journal:
+            self.journal.close()
+
+    def _put(self, table: str, rows: Dict[str, dict], key: str, document: dict):
+        rows[key] = document
+        if self.journal:
+            self.journal.put(table, key, document)
+
+    def _delete(self, table: str, rows: Dict[str, dict], key: str) -> bool:
+        if rows.pop(key, None) is None:
+            return False
+        if self.journal:
+            self.journal.delete(table, key)
+        return True
+
+    async def insert_server(self, server: dict):
+        if server["id"] in self.servers:
+            raise DuplicateKeyError(f"Duplicate RDP server id: {server['id']}")
+        self._put("rdp_servers", self.servers, server["id"], dict(server))
+
+    async def get_server(self, server_id: str) -> Optional[dict]:
+        server = self.servers.get(server_id)
+        return dict(server) if server else None
+
+    async def find_servers(self, q=None, os_type=None, status=None, host=None, sort="created_at", cursor=None, limit=1000):
+        sort_field, direction = parse_sort(sort)
+        terms = set(q.lower().split()) if q else None
+        after = decode_cursor(cursor, sort_field) if cursor else None
+        descending = direction == DESCENDING
+
+        matches = []
+        for server in self.servers.values():
+            if os_type and server.get("os_type") != os_type:
+                continue
+            if status and server.get("status") != status:
+                continue
+            if host and not server.get("host", "").startswith(host):
+                continue
+            if terms:
+                # Word match over the same fields as the Mongo text index
+                words = set(re.findall(r"\w+", " ".join(
+                    str(server.get(field) or "") for field in ("name", "host", "description")
+                ).lower()))
+                if not terms & words:
+                    continue
+            position = (server[sort_field], server["id"])
+            if after is not None and (position <= after if not descending else position >= after):
+                continue
+            matches.append(server)
+
+        matches.sort(key=lambda server: (server[sort_field], server["id"]), reverse=descending)
+        return [dict(server) for server in matches[:limit]]
+
+    async def update_server(self, server_id: str, fields: dict) -> bool:
+        server = self.servers.get(server_id)
+        if server is None:
+            return False
+        self._put("rdp_servers", self.servers, server_id, {**server, **fields})
+        return True
+
+    async def update_servers(self, server_ids, fields, status=None, updated_before=None) -> int:
+        updated = 0
+        for server_id in server_ids:
+            server = self.servers.get(server_id)
+            if server is None or (status is not None and server.get("status") != status):
+                continue
+            if updated_before is not None and not (server.get("updated_at") and server["updated_at"] <= updated_before):
+                continue
+            updated += await self.update_server(server_id, fields)
+        return updated
+
+    async def delete_server(self, server_id: str) -> bool:
+        return self._delete("rdp_servers", self.servers, server_id)
+
+    async def migrate_inline_credentials(self, encrypt) -> int:
+        inline = [server for server in self.servers.values() if "password" in server]
+        for server in inline:
+            await self.set_credentials(server["id"], {"password": encrypt(server["password"]), "updated_at": datetime.utcnow()})
+            self._put("rdp_servers", self.servers, server["id"],
+                      {field: value for field, value in server.items() if field != "password"})
+        return len(inline)
+
+    async def count_servers_by_guacamole_url(self) -> Dict[Optional[str], int]:
+        return dict(Counter(server.get("guacamole_url") for server in self.servers.values()))
+
+    async def set_credentials(self, server_id: str, fields: dict):
+        credentials = {**self.credentials.get(server_id, {}), **fields, "server_id": server_id}
+        self._put("rdp_credentials", self.credentials, server_id, credentials)
+
+    async def get_credentials(self, server_id: str) -> Optional[dict]:
+        credentials = self.credentials.get(server_id)
+        return dict(credentials) if credentials else None
+
+    async def delete_credentials(self, server_id: str):
+        self._delete("rdp_credentials", self.credentials, server_id)
+
+    def _index_connection(self, connection: dict):
+        previous = self.connections.get(connection["id"])
+        if previous is not None:
+            self.connections_by_server_status[(previous["server_id"], _plain(previous["status"]))].discard(previous["id"])
+        self.connections[connection["id"]] = connection
+        self.connections_by_server_status[(connection["server_id"], _plain(connection["status"]))].add(connection["id"])
+
+    async def insert_connection(self, connection: dict):
+        if connection["id"] in self.connections:
+            raise DuplicateKeyError(f"Duplicate RDP connection id: {connection['id']}")
+        self._index_connection(dict(connection))
+        if self.journal:
+            self.journal.put("rdp_connections", connection["id"], connection)
+
+    async def get_connection(self, connection_id: str) -> Optional[dict]:
+        connection = self.connections.get(connection_id)
+        return dict(connection) if connection else None
+
+    async def list_connections(self, statuses=None, limit=1000) -> List[dict]:
+        if statuses is None:
+            connections = self.connections.values()
+        else:
+            wanted = {_plain(status) for status in statuses}
+            connections = (
+                self.connections[connection_id]
+                for (_, status), ids in self.connections_by_server_status.items() if status in wanted
+                for connection_id in ids
+            )
+        result = []
+        for connection in connections:
+            if len(result) >= limit:
+                break
+            result.append(dict(connection))
+        return result
+
+    async def update_connection(self, connection_id: str, fields: dict) -> bool:
+        connection = self.connections.get(connection_id)
+        if connection is None:
+            return False
+        updated = {**connection, **fields}
+        self._index_connection(updated)
+        if self.journal:
+            self.journal.put("rdp_connections", connection_id, updated)
+        return True
+
+    async def count_connections(self, server_id: str, statuses) -> int:
+        return sum(len(self.connections_by_server_status.get((server_id, _plain(status)), ())) for status in statuses)
+
+    async def count_connections_by_server(self, statuses) -> Dict[str, int]:
+        wanted = {_plain(status) for status in statuses}
+        counts: Dict[str, int] = Counter()
+        for (server_id, status), ids in self.connections_by_server_status.items():
+            if status in wanted and ids:
+                counts[server_id] += len(ids)
+        return dict(counts)
+
+    async def iter_connections_started_before(self, statuses, started_before, batch_size=500):
+        wanted = {_plain(status) for status in statuses}
+        matches = sorted(
+            (self.connections[connection_id]
+             for (_, status), ids in self.connections_by_server_status.items() if status in wanted
+             for connection_id in ids
+             if self.connections[connection_id]["started_at"] < started_before),
+            key=lambda connection: connection["started_at"]
+        )
+        for start in range(0, len(matches), batch_size):
+            yield [dict(connection) for connection in matches[start:start + batch_size]]
+
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        lease = self.leases.get(name)
+        if lease and lease["owner"] != owner and lease["expires_at"] > now:
+            return False
+        self.leases[name] = {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds)}
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        if self.leases.get(name, {}).get("owner") == owner:
+            del self.leases[name]
+
+    async def iter_connection_history(self, since, until, batch_size=5000):
+        matches = sorted(
+            (connection for connection in self.connections.values() if since <= connection["started_at"] < until),
+            key=lambda connection: connection["started_at"]
+        )
+        for start in range(0, len(matches), batch_size):
+            yield [{field: connection.get(field) for field in CONNECTION_HISTORY_FIELDS}
+                   for connection in matches[start:start + batch_size]]
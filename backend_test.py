@@ -73,6 +73,7 @@ def test_create_windows_server():
     assert data["os_type"] == windows_server["os_type"]
     assert data["description"] == windows_server["description"]
     assert data["status"] == "inactive"
+    assert "password" not in data
     
     # Check if Guacamole connection ID is set (may be None if mock server isn't running)
     if "guacamole_connection_id" in data:
@@ -124,9 +125,41 @@ def test_list_servers():
     for server_id in created_servers:
         assert server_id in server_ids
     
+    # Credentials live in their own collection and never appear in listings
+    assert all("password" not in server for server in data)
+    
     print(f"✅ Successfully listed {len(data)} RDP servers")
     return data
 
+def test_search_servers():
+    """Test server-side search, filtering and pagination of RDP servers"""
+    print("\n=== Testing Search RDP Servers ===")
+    response = requests.get(f"{API_URL}/rdp-servers", params={"os_type": "linux", "host": "ubuntu-server"})
+    assert response.status_code == 200, f"Failed to search servers: {response.text}"
+    data = response.json()
+    assert data and all(server["os_type"] == "linux" for server in data)
+    assert all(server["host"].startswith("ubuntu-server") for server in data)
+    
+    response = requests.get(f"{API_URL}/rdp-servers", params={"q": "Ubuntu"})
+    assert response.status_code == 200, f"Failed to search servers: {response.text}"
+    assert any(server["name"] == linux_server["name"] for server in response.json())
+    
+    # Walk the full list one server at a time using the next-page cursor
+    seen = []
+    params = {"sort": "-created_at", "limit": 1}
+    while True:
+        response = requests.get(f"{API_URL}/rdp-servers", params=params)
+        assert response.status_code == 200, f"Failed to page servers: {response.text}"
+        seen.extend(server["id"] for server in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert len(seen) == len(set(seen))
+    for server_id in created_servers:
+        assert server_id in seen
+    
+    print(f"✅ Successfully searched and paged through {len(seen)} RDP servers")
+
 def test_get_server_details():
     """Test getting details for a specific RDP server"""
     print("\n=== Testing Get RDP Server Details ===")
@@ -435,6 +468,7 @@ def run_all_tests():
         windows_id = test_create_windows_server()
         linux_id = test_create_linux_server()
         test_list_servers()
+        test_search_servers()
         test_get_server_details()
         test_update_server()
         
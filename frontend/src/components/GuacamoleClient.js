@@ -18,7 +18,7 @@ const GuacamoleClient = ({ serverId, onClose }) => {
           headers: {
             'Content-Type': 'application/x-www-form-urlencoded',
           },
-          body: 'username=guacadmin&password=guacadmin'
+          body: `username=guacadmin&password=guacadmin&server_id=${encodeURIComponent(serverId)}`
         });
 
         if (!authResponse.ok) {
@@ -37,9 +37,10 @@ const GuacamoleClient = ({ serverId, onClose }) => {
 
         const connectionData = await connectionResponse.json();
         
-        // Create WebSocket tunnel
+        // Create WebSocket tunnel on the Guacamole backend holding this server's connection
         setStatus('Connecting...');
-        const tunnel = new Guacamole.WebSocketTunnel('ws://localhost:8080/guacamole/websocket-tunnel');
+        const tunnelUrl = `${connectionData.guacamole_url.replace(/^http/, 'ws')}/websocket-tunnel`;
+        const tunnel = new Guacamole.WebSocketTunnel(tunnelUrl);
         
         // Create Guacamole client
         const client = new Guacamole.Client(tunnel);
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
+import sys
 import urllib.parse as urlparse
 import uuid
 from datetime import datetime
@@ -65,6 +66,18 @@ class GuacamoleMockHandler(BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
     
+    def do_PUT(self):
+        if 'connections' in self.path:
+            # Mock connection update
+            content_length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(content_length)
+            self.send_response(204)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+        else:
+            self.send_response(404)
+            self.end_headers()
+    
     def do_DELETE(self):
         # Mock deletion
         self.send_response(204)
@@ -75,12 +88,14 @@ class GuacamoleMockHandler(BaseHTTPRequestHandler):
         # Handle CORS preflight
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
 if __name__ == '__main__':
-    server = HTTPServer(('localhost', 8080), GuacamoleMockHandler)
-    print("Mock Guacamole server running on http://localhost:8080")
+    # Pass a port to run several mocks side by side, e.g. for a GUACAMOLE_URLS pool
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    server = HTTPServer(('localhost', port), GuacamoleMockHandler)
+    print(f"Mock Guacamole server running on http://localhost:{port}")
     print("This is a development mock - not a real Guacamole server")
     server.serve_forever()
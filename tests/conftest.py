@@ -0,0 +1,100 @@
+import asyncio
+import inspect
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+from pymongo.errors import DuplicateKeyError
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+os.environ.setdefault("CREDENTIALS_KEY", Fernet.generate_key().decode())
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """Run `async def` tests in a fresh event loop"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+
+class FakeCollection:
+    """In-memory stand-in for the Motor collection calls made by the code under test.
+
+    Queries match on equality and {"$exists": bool}; updates support $set and $unset.
+    insert_many calls are also recorded as batches, and fail=True makes them raise.
+    With `unique` fields, inserting a second document with the same values raises
+    DuplicateKeyError like a unique index would.
+    """
+
+    def __init__(self, unique=None, fail=False):
+        self.documents = []
+        self.batches = []
+        self.unique = unique
+        self.fail = fail
+
+    @staticmethod
+    def _matches(document, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict) and "$exists" in condition:
+                if (field in document) != condition["$exists"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    async def insert_one(self, document):
+        if self.unique and any(
+            all(stored.get(field) == document.get(field) for field in self.unique) for stored in self.documents
+        ):
+            raise DuplicateKeyError(f"Duplicate key: {[document.get(field) for field in self.unique]}")
+        self.documents.append(dict(document))
+
+    async def insert_many(self, documents, ordered=True):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.batches.append(list(documents))
+        for document in documents:
+            await self.insert_one(document)
+
+    async def find(self, query, projection=None):
+        for document in list(self.documents):
+            if self._matches(document, query):
+                yield dict(document)
+
+    async def find_one(self, query, projection=None):
+        for document in self.documents:
+            if self._matches(document, query):
+                return dict(document)
+        return None
+
+    async def update_one(self, query, update, upsert=False):
+        for document in self.documents:
+            if self._matches(document, query):
+                document.update(update.get("$set", {}))
+                for field in update.get("$unset", {}):
+                    document.pop(field, None)
+                return
+        if upsert:
+            self.documents.append({**query, **update.get("$set", {})})
+
+    async def delete_one(self, query):
+        for document in self.documents:
+            if self._matches(document, query):
+                self.documents.remove(document)
+                return
+
+
+class FakeDatabase:
+    """Database whose collections are FakeCollections created on first access"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.collections.setdefault(name, FakeCollection())
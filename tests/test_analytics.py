@@ -0,0 +1,98 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import analytics
+import server
+from storage import MemoryStorage
+
+START = datetime(2024, 1, 1)
+
+
+async def populate(storage, sessions=1000, subsecond=False):
+    rng = np.random.default_rng(7)
+    offsets = np.sort(rng.integers(0, 7 * 24 * 3600, sessions))
+    durations = rng.integers(30, 4 * 3600, sessions)
+    for i, (offset, duration) in enumerate(zip(offsets, durations)):
+        started_at = START + timedelta(seconds=int(offset), microseconds=(i * 7919) % 1_000_000 if subsecond else 0)
+        ended = i % 50 != 0
+        await storage.insert_connection({
+            "id": f"connection-{i}", "server_id": f"server-{i % 7}", "session_id": f"session-{i}",
+            "status": "inactive" if ended else "active", "started_at": started_at,
+            "ended_at": started_at + timedelta(seconds=int(duration)) if ended else None,
+        })
+    return durations
+
+
+async def test_stats_match_exact_computation_in_small_batches():
+    storage = MemoryStorage()
+    durations = await populate(storage)
+    until = START + timedelta(days=8)
+
+    stats = await analytics.session_stats(
+        storage.iter_connection_history(START, until, batch_size=64), START, until, resolution=1
+    )
+
+    completed = np.array([d for i, d in enumerate(durations) if i % 50 != 0])
+    assert stats["sessions"] == 1000 and stats["open_sessions"] == 20
+    assert stats["duration_seconds"]["p50"] == pytest.approx(np.percentile(completed, 50), rel=0.03)
+    assert stats["duration_seconds"]["p99"] == pytest.approx(np.percentile(completed, 99), rel=0.03)
+    assert stats["duration_seconds"]["max"] == completed.max()
+
+    history = pd.DataFrame(list(storage.connections.values()))
+    ended = history["ended_at"].fillna(until)
+    events = pd.concat([pd.Series(1, index=history["started_at"]), pd.Series(-1, index=ended + pd.Timedelta(seconds=1))])
+    assert stats["peak_concurrency"] == events.groupby(level=0).sum().sort_index().cumsum().max()
+    assert sum(server_usage["sessions"] for server_usage in stats["servers"]) == 1000
+
+
+def test_exports_stream_every_session(monkeypatch):
+    storage = MemoryStorage()
+    asyncio.run(populate(storage, sessions=300, subsecond=True))
+    monkeypatch.setattr(server, "storage", storage)
+    client = TestClient(server.app)
+    params = {"since": "2024-01-01T00:00:00", "until": "2024-02-01T00:00:00", "batch_size": 100}
+
+    response = client.get("/api/analytics/sessions/export", params=params)
+    assert response.status_code == 200
+    exported = pd.read_csv(io.StringIO(response.text))
+    assert len(exported) == 300
+    assert list(exported.columns) == analytics.EXPORT_COLUMNS
+    assert set(exported["status"]) == {"active", "inactive"}
+
+    pytest.importorskip("pyarrow")
+    response = client.get("/api/analytics/sessions/export", params={**params, "format": "parquet"})
+    assert response.status_code == 200
+    table = pd.read_parquet(io.BytesIO(response.content))
+    assert len(table) == 300
+    assert table["duration_seconds"].isna().sum() == 6
+    assert table["started_at"].dt.microsecond.any()
+
+
+def test_offset_aware_window_is_converted_to_utc(monkeypatch):
+    storage = MemoryStorage()
+    asyncio.run(populate(storage, sessions=200))
+    monkeypatch.setattr(server, "storage", storage)
+    client = TestClient(server.app)
+
+    naive = client.get("/api/analytics/sessions", params={"since": "2024-01-02T00:00:00", "until": "2024-01-05T12:00:00"})
+    aware = client.get("/api/analytics/sessions", params={"since": "2024-01-02T02:00:00+02:00", "until": "2024-01-05T12:00:00Z"})
+    assert naive.status_code == aware.status_code == 200
+    assert aware.json() == naive.json()
+    assert 0 < aware.json()["sessions"] < 200
+
+
+def test_resolution_must_keep_buckets_bounded(monkeypatch):
+    monkeypatch.setattr(server, "storage", MemoryStorage())
+    client = TestClient(server.app)
+    params = {"since": "2024-01-01T00:00:00", "until": "2024-03-01T00:00:00"}
+
+    response = client.get("/api/analytics/sessions", params={**params, "resolution_seconds": 1})
+    assert response.status_code == 400
+    assert "resolution_seconds >= 6" in response.json()["detail"]
+    assert client.get("/api/analytics/sessions", params={**params, "resolution_seconds": 6}).status_code == 200
@@ -0,0 +1,35 @@
+import pytest
+
+import server
+from storage import MemoryStorage, MotorStorage
+
+from .conftest import FakeDatabase
+
+
+def test_secrets_round_trip_and_are_not_stored_in_clear():
+    token = server.encrypt_secret("SecureP@ssw0rd!")
+    assert "SecureP@ssw0rd!" not in token
+    assert server.decrypt_secret(token) == "SecureP@ssw0rd!"
+
+
+def test_missing_key_fails_with_a_clear_error(monkeypatch):
+    monkeypatch.delenv("CREDENTIALS_KEY")
+    with pytest.raises(RuntimeError, match="CREDENTIALS_KEY is not set.*generate_key"):
+        server.load_credentials_cipher()
+
+
+@pytest.mark.parametrize("make_storage", [MemoryStorage, lambda: MotorStorage(FakeDatabase())])
+async def test_inline_passwords_are_migrated_once(monkeypatch, make_storage):
+    storage = make_storage()
+    monkeypatch.setattr(server, "storage", storage)
+    legacy = server.RDPServer(name="legacy", host="a", username="admin")
+    await storage.insert_server({**legacy.dict(), "password": "inline-secret"})
+    await storage.insert_server(server.RDPServer(name="current", host="b", username="admin").dict())
+
+    assert await server.migrate_inline_credentials() == 1
+    assert await server.migrate_inline_credentials() == 0
+
+    assert "password" not in await storage.get_server(legacy.id)
+    assert (await storage.get_credentials(legacy.id))["password"] != "inline-secret"
+    credentials = await server.load_server_credentials(legacy.id)
+    assert credentials.password == "inline-secret"
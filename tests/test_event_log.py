@@ -0,0 +1,49 @@
+import asyncio
+
+from event_log import SessionEventLog, SessionEventType
+
+from .conftest import FakeCollection
+
+
+async def test_flushes_in_batches_when_size_reached():
+    collection = FakeCollection()
+    events = SessionEventLog(collection, batch_size=3, flush_interval=60)
+    events.start()
+    for i in range(7):
+        events.record(SessionEventType.CONNECT, f"server-{i}")
+    await asyncio.sleep(0.01)
+    assert events.stats()["written"] == 7
+    await events.stop()
+
+    assert [len(batch) for batch in collection.batches] == [3, 3, 1]
+    assert events.stats()["written"] == 7
+    assert events.stats()["buffered"] == 0
+
+
+async def test_flushes_on_interval():
+    collection = FakeCollection()
+    events = SessionEventLog(collection, batch_size=100, flush_interval=0.01)
+    events.start()
+    events.record(SessionEventType.DISCONNECT, "server-1", "connection-1")
+    await asyncio.sleep(0.05)
+    assert len(collection.batches) == 1
+    await events.stop()
+
+    assert events.stats()["flushes"] == 1
+
+
+def test_drops_events_when_buffer_is_full():
+    events = SessionEventLog(FakeCollection(), max_buffer=2, batch_size=10)
+    for _ in range(5):
+        events.record(SessionEventType.PROVISION, "server-1")
+    stats = events.stats()
+    assert stats["buffered"] == 2
+    assert stats["dropped"] == 3
+
+
+async def test_counts_failed_writes():
+    events = SessionEventLog(FakeCollection(fail=True))
+    events.record(SessionEventType.CONNECT, "server-1")
+    await events.flush()
+    assert events.stats()["failed"] == 1
+    assert events.stats()["buffered"] == 0
@@ -0,0 +1,101 @@
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import server
+from guacamole_pool import GuacamolePool
+from storage import MemoryStorage
+
+from .conftest import ROOT
+
+
+def test_adding_a_backend_only_moves_its_share_of_keys():
+    before = GuacamolePool(["http://g1", "http://g2", "http://g3"])
+    after = GuacamolePool(["http://g1", "http://g2", "http://g3", "http://g4"])
+    keys = [f"server-{i}" for i in range(2000)]
+    moved = [key for key in keys if before.hashed_url(key) != after.hashed_url(key)]
+    assert all(after.hashed_url(key) == "http://g4" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+def test_least_loaded_backend_overrides_an_overloaded_hash():
+    pool = GuacamolePool(["http://g1", "http://g2"])
+    key = next(f"server-{i}" for i in range(100) if pool.hashed_url(f"server-{i}") == "http://g1")
+    assert pool.place(key, {"http://g1": 5, "http://g2": 5}) == "http://g1"
+    assert pool.place(key, {"http://g1": 20, "http://g2": 5}) == "http://g2"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def guacamole_mocks():
+    ports = [free_port() for _ in range(3)]
+    processes = [
+        subprocess.Popen([sys.executable, str(ROOT / "guacamole-mock" / "server.py"), str(port)],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for port in ports
+    ]
+    for port in ports:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(("localhost", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+    yield [f"http://localhost:{port}" for port in ports]
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+async def test_servers_are_sharded_and_rebalanced(monkeypatch, guacamole_mocks):
+    monkeypatch.setattr(server, "storage", MemoryStorage())
+    monkeypatch.setattr(server, "guacamole_pool", GuacamolePool(guacamole_mocks[:2]))
+    monkeypatch.setattr(server, "guacamole_loads", server.GuacamoleLoads())
+
+    for i in range(30):
+        await server.provision_rdp_server(server.RDPServerCreate(
+            name=f"Server {i}", host=f"host-{i}", username="admin", password="secret"
+        ))
+    placed = await server.guacamole_backend_loads()
+    assert placed == await server.guacamole_backend_loads(fresh=True)
+    assert placed[guacamole_mocks[0]] + placed[guacamole_mocks[1]] == 30
+    assert min(placed.values()) >= 10
+
+    monkeypatch.setattr(server, "guacamole_pool", GuacamolePool(guacamole_mocks))
+    result = await server.rebalance_guacamole_connections()
+    assert result["failed"] == 0 and result["moved"] == result["planned"] > 0
+    assert await server.guacamole_backend_loads() == await server.guacamole_backend_loads(fresh=True)
+    assert all(server_doc["guacamole_connection_id"] for server_doc in server.storage.servers.values())
+
+    for move in result["moves"]:
+        info = await server.get_guacamole_connection_url(move["server_id"])
+        assert info["guacamole_url"] == f"{move['to']}/guacamole"
+
+
+async def test_servers_with_open_sessions_are_not_moved(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+    monkeypatch.setattr(server, "guacamole_pool", GuacamolePool(["http://g1", "http://g2"]))
+    monkeypatch.setattr(server, "guacamole_loads", server.GuacamoleLoads())
+    for i in range(20):
+        await storage.insert_server(server.RDPServer(
+            name=f"Server {i}", host="h", username="u", guacamole_url="http://gone", guacamole_connection_id=str(i)
+        ).dict())
+    busy = next(iter(storage.servers))
+    await storage.insert_connection(server.RDPConnection(server_id=busy, session_id="s", status="active").dict())
+
+    result = await server.rebalance_guacamole_connections(dry_run=True)
+    assert result["busy"] == [busy]
+    assert result["planned"] == 19
+    assert busy not in {move["server_id"] for move in result["moves"]}
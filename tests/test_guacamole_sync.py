@@ -0,0 +1,116 @@
+import asyncio
+
+import server
+from storage import MemoryStorage
+
+
+def test_diff_only_reports_changed_connection_fields():
+    current = {"name": "Server", "host": "a.example.com", "port": 3389, "description": "old"}
+    update = {"name": "Server", "host": "b.example.com", "description": "new", "password": "secret"}
+    assert server.diff_guacamole_fields(current, update) == {"host", "password"}
+
+
+async def test_updates_are_coalesced_and_batched(monkeypatch):
+    calls = {"auth": 0, "update": []}
+
+    async def authenticate(username, password, base_url=None):
+        calls["auth"] += 1
+        return {"authToken": "token"}
+
+    async def update_connection(auth_token, rdp_server, credentials):
+        calls["update"].append((rdp_server.id, rdp_server.host, credentials.password))
+        return True
+
+    monkeypatch.setattr(server, "storage", MemoryStorage())
+    monkeypatch.setattr(server, "authenticate_guacamole", authenticate)
+    monkeypatch.setattr(server, "update_guacamole_connection", update_connection)
+    monkeypatch.setattr(server, "guacamole_sync", server.GuacamoleSync(delay=0.01, concurrency=2))
+
+    for i in range(3):
+        rdp_server = server.RDPServer(name=f"Server {i}", host="old.example.com", username="admin",
+                                      guacamole_connection_id=f"guac-{i}")
+        await server.storage.insert_server(rdp_server.dict())
+        await server.store_server_credentials(rdp_server.id, "initial")
+
+    servers = await server.storage.find_servers(sort="name")
+    first = servers[0]["id"]
+    await server.update_rdp_server(first, server.RDPServerUpdate(host="new.example.com"))
+    await server.update_rdp_server(first, server.RDPServerUpdate(password="rotated"))
+    await server.update_rdp_server(first, server.RDPServerUpdate(description="not in Guacamole"))
+    await server.bulk_update_rdp_servers([
+        server.RDPServerBulkUpdate(id=s["id"], port=3390) for s in servers[1:]
+    ])
+    await asyncio.sleep(0.05)
+
+    assert calls["auth"] == 1
+    assert len(calls["update"]) == 3
+    assert (first, "new.example.com", "rotated") in calls["update"]
+
+
+async def test_description_only_edit_does_not_touch_guacamole(monkeypatch):
+    sync = server.GuacamoleSync(delay=0.01)
+    monkeypatch.setattr(server, "storage", MemoryStorage())
+    monkeypatch.setattr(server, "guacamole_sync", sync)
+
+    rdp_server = server.RDPServer(name="Server", host="host", username="admin", guacamole_connection_id="guac")
+    await server.storage.insert_server(rdp_server.dict())
+    await server.update_rdp_server(rdp_server.id, server.RDPServerUpdate(description="notes", host="host"))
+
+    assert sync.pending == {}
+
+
+async def test_failed_pushes_are_retried_and_flagged_until_they_succeed(monkeypatch):
+    outcomes = [False, False, True]
+
+    async def authenticate(username, password, base_url=None):
+        return {"authToken": "token"}
+
+    async def update_connection(auth_token, rdp_server, credentials):
+        return outcomes.pop(0)
+
+    storage = MemoryStorage()
+    sync = server.GuacamoleSync(delay=0.01)
+    monkeypatch.setattr(server, "storage", storage)
+    monkeypatch.setattr(server, "authenticate_guacamole", authenticate)
+    monkeypatch.setattr(server, "update_guacamole_connection", update_connection)
+    monkeypatch.setattr(server, "guacamole_sync", sync)
+
+    rdp_server = server.RDPServer(name="Server", host="old", username="admin", guacamole_connection_id="guac")
+    await storage.insert_server(rdp_server.dict())
+    await server.store_server_credentials(rdp_server.id, "secret")
+    await server.update_rdp_server(rdp_server.id, server.RDPServerUpdate(host="new"))
+
+    await asyncio.sleep(0.03)
+    assert storage.servers[rdp_server.id]["guacamole_sync_pending"] is True
+    await asyncio.sleep(0.1)
+    assert outcomes == []
+    assert storage.servers[rdp_server.id]["guacamole_sync_pending"] is False
+    assert sync.attempts == {}
+
+
+async def test_close_waits_for_the_flush_in_progress(monkeypatch):
+    pushed = []
+
+    async def authenticate(username, password, base_url=None):
+        return {"authToken": "token"}
+
+    async def update_connection(auth_token, rdp_server, credentials):
+        await asyncio.sleep(0.05)
+        pushed.append(rdp_server.id)
+        return True
+
+    sync = server.GuacamoleSync(delay=0.01)
+    monkeypatch.setattr(server, "storage", MemoryStorage())
+    monkeypatch.setattr(server, "authenticate_guacamole", authenticate)
+    monkeypatch.setattr(server, "update_guacamole_connection", update_connection)
+    monkeypatch.setattr(server, "guacamole_sync", sync)
+
+    rdp_server = server.RDPServer(name="Server", host="old", username="admin", guacamole_connection_id="guac")
+    await server.storage.insert_server(rdp_server.dict())
+    await server.store_server_credentials(rdp_server.id, "secret")
+    await server.update_rdp_server(rdp_server.id, server.RDPServerUpdate(host="new"))
+    await asyncio.sleep(0.02)
+
+    assert sync.pending == {}
+    await sync.close()
+    assert pushed == [rdp_server.id]
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore, request_fingerprint
+
+from .conftest import FakeCollection
+
+
+def make_store():
+    return IdempotencyStore(FakeCollection(unique=("scope", "key")))
+
+
+def make_handler(calls):
+    async def execute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": f"server-{len(calls)}"}
+    return execute
+
+
+async def test_replays_stored_response():
+    store, calls = make_store(), []
+    fingerprint = request_fingerprint({"server_id": "a"})
+    first = await store.run("POST /api/connections", "key-1", fingerprint, make_handler(calls))
+    second = await store.run("POST /api/connections", "key-1", fingerprint, make_handler(calls))
+
+    assert first == ({"id": "server-1"}, False)
+    assert second == ({"id": "server-1"}, True)
+    assert len(calls) == 1
+
+
+async def test_coalesces_concurrent_duplicates():
+    store, calls = make_store(), []
+    fingerprint = request_fingerprint({"server_id": "a"})
+    results = await asyncio.gather(*[
+        store.run("POST /api/connections", "key-1", fingerprint, make_handler(calls)) for _ in range(5)
+    ])
+
+    assert len(calls) == 1
+    assert {response["id"] for response, _ in results} == {"server-1"}
+
+
+async def test_rejects_key_reused_with_different_request():
+    store, calls = make_store(), []
+    await store.run("POST /api/connections", "key-1", request_fingerprint({"server_id": "a"}), make_handler(calls))
+    with pytest.raises(HTTPException) as error:
+        await store.run("POST /api/connections", "key-1", request_fingerprint({"server_id": "b"}), make_handler(calls))
+    assert error.value.status_code == 422
+
+
+async def test_failed_execution_releases_key():
+    async def failing():
+        raise HTTPException(status_code=404, detail="RDP Server not found")
+
+    store = make_store()
+    with pytest.raises(HTTPException):
+        await store.run("POST /api/connections", "key-1", "fingerprint", failing)
+    assert store.collection.documents == []
+
+
+async def test_abandoned_pending_claim_is_taken_over():
+    store, calls = make_store(), []
+    store.pending_timeout_seconds = 0.05
+    fingerprint = request_fingerprint({"server_id": "a"})
+    # A worker that died after claiming the key
+    await store.collection.insert_one({
+        "scope": "POST /api/connections", "key": "key-1", "fingerprint": fingerprint, "status": "pending",
+        "claim": "dead-worker", "pending_until": datetime.utcnow() + timedelta(seconds=0.05),
+        "created_at": datetime.utcnow(),
+    })
+
+    assert await store.run("POST /api/connections", "key-1", fingerprint, make_handler(calls)) == ({"id": "server-1"}, False)
+    assert (await store.collection.find_one({"key": "key-1"}))["status"] == "completed"
+    assert (await store.collection.find_one({"key": "key-1"}))["claim"] != "dead-worker"
+
+
+async def test_duplicate_on_another_worker_waits_for_the_stored_response():
+    collection, calls = FakeCollection(unique=("scope", "key")), []
+    first_worker, second_worker = IdempotencyStore(collection), IdempotencyStore(collection, poll_interval=0.005)
+    fingerprint = request_fingerprint({"server_id": "a"})
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"id": "server-1"}
+
+    first, second = await asyncio.gather(
+        first_worker.run("POST /api/connections", "key-1", fingerprint, slow),
+        second_worker.run("POST /api/connections", "key-1", fingerprint, slow),
+    )
+    assert first == ({"id": "server-1"}, False)
+    assert second == ({"id": "server-1"}, True)
+    assert len(calls) == 1
+
+
+def test_fingerprint_leaves_out_secrets():
+    assert request_fingerprint({"name": "a", "password": "one"}) == request_fingerprint({"name": "a", "password": "two"})
+    assert request_fingerprint({"name": "a"}) != request_fingerprint({"name": "b"})
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from loop_monitor import LoopLagMonitor
+
+
+def blocking_validation():
+    time.sleep(0.2)
+
+
+async def handler():
+    blocking_validation()
+
+
+async def test_traces_the_task_blocking_the_loop():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await asyncio.create_task(handler(), name="slow-request")
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    stats = monitor.stats()
+    assert stats["stalls"] == 1
+    assert stats["lag_max_ms"] >= 150
+    [stall] = stats["recent_stalls"]
+    assert stall["task"] == "slow-request"
+    assert any("blocking_validation" in line for line in stall["stack"])
+
+
+async def test_idle_loop_reports_no_stalls():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    await asyncio.sleep(0.1)
+    await monitor.stop()
+
+    stats = monitor.stats()
+    assert stats["stalls"] == 0
+    assert stats["lag_p99_ms"] < 50
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from storage import MemoryStorage, encode_cursor
+
+
+def make_server(i, **fields):
+    return {
+        "id": f"server-{i:02d}", "name": f"Server {i}", "host": f"host-{i}.example.com",
+        "os_type": ["windows", "linux"][i % 2], "status": "inactive", "description": None,
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=i), "updated_at": datetime(2024, 1, 1),
+        **fields,
+    }
+
+
+def make_connection(i, server_id, status="active"):
+    return {"id": f"connection-{i}", "server_id": server_id, "session_id": f"session-{i}",
+            "status": status, "started_at": datetime(2024, 1, 1), "ended_at": None}
+
+
+async def test_find_servers_filters_sorts_and_pages():
+    storage = MemoryStorage()
+    for i in range(10):
+        await storage.insert_server(make_server(i, description="Ubuntu box" if i == 3 else None))
+
+    linux = await storage.find_servers(os_type="linux", sort="-created_at")
+    assert [server["id"] for server in linux] == ["server-09", "server-07", "server-05", "server-03", "server-01"]
+    assert [server["id"] for server in await storage.find_servers(q="ubuntu")] == ["server-03"]
+    assert [server["id"] for server in await storage.find_servers(host="host-1")] == ["server-01"]
+
+    first = await storage.find_servers(sort="name", limit=4)
+    rest = await storage.find_servers(sort="name", cursor=encode_cursor(first[-1], "name"))
+    assert [s["id"] for s in first + rest] == [s["id"] for s in await storage.find_servers(sort="name")]
+    assert len(rest) == 6
+
+
+async def test_connection_index_tracks_status_changes():
+    storage = MemoryStorage()
+    await storage.insert_connection(make_connection(1, "server-01"))
+    await storage.insert_connection(make_connection(2, "server-01", "connecting"))
+    await storage.insert_connection(make_connection(3, "server-02"))
+    assert await storage.count_connections("server-01", ["active", "connecting"]) == 2
+
+    await storage.update_connection("connection-1", {"status": "inactive"})
+    assert await storage.count_connections("server-01", ["active", "connecting"]) == 1
+    active = await storage.list_connections(["active", "connecting"])
+    assert {connection["id"] for connection in active} == {"connection-2", "connection-3"}
+
+
+async def test_journal_survives_restart(tmp_path):
+    path = tmp_path / "rdp.json"
+    storage = MemoryStorage(path)
+    await storage.prepare()
+    await storage.insert_server(make_server(1))
+    await storage.insert_server(make_server(2))
+    await storage.update_server("server-01", {"status": "active"})
+    await storage.delete_server("server-02")
+    await storage.set_credentials("server-01", {"password": "encrypted"})
+    await storage.insert_connection(make_connection(1, "server-01"))
+    await storage.close()
+
+    storage = MemoryStorage(path)
+    await storage.prepare()
+    assert list(storage.servers) == ["server-01"]
+    assert storage.servers["server-01"]["status"] == "active"
+    assert storage.servers["server-01"]["created_at"] == datetime(2024, 1, 1, 0, 1)
+    assert storage.credentials["server-01"]["password"] == "encrypted"
+    assert await storage.count_connections("server-01", ["active"]) == 1
+    assert path.with_name("rdp.json.log").read_text() == ""
+
+
+async def test_collection_looks_up_unique_fields_by_key():
+    collection = MemoryStorage().idempotency_keys
+    await collection.create_index([("scope", 1), ("key", 1)], unique=True)
+    await collection.insert_one({"scope": "servers", "key": "a", "claim": "c1"})
+    await collection.insert_one({"scope": "servers", "key": "b", "claim": "c2"})
+
+    assert (await collection.find_one({"scope": "servers", "key": "b"}))["claim"] == "c2"
+    assert await collection.find_one({"scope": "servers", "key": "b", "claim": "c1"}) is None
+    assert (await collection.find_one({"claim": "c1"}))["key"] == "a"
+
+    await collection.update_one({"scope": "servers", "key": "a", "claim": "other"}, {"$set": {"response": 1}})
+    await collection.update_one({"scope": "servers", "key": "a", "claim": "c1"}, {"$set": {"response": 2}})
+    assert (await collection.find_one({"scope": "servers", "key": "a"}))["response"] == 2
+
+    await collection.delete_one({"scope": "servers", "key": "b", "claim": "other"})
+    await collection.delete_one({"scope": "servers", "key": "a", "claim": "c1"})
+    assert [document["key"] for document in collection.documents.values()] == ["b"]
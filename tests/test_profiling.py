@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import Counter
+
+from profiling import ProfileStore, ProfilingMiddleware, sign_profile_request
+
+
+async def slow_endpoint(scope, receive, send):
+    await asyncio.sleep(0.05)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def call(middleware, path, headers=()):
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    await middleware(scope, receive, send)
+
+
+async def test_signed_request_is_profiled(tmp_path):
+    store = ProfileStore(tmp_path)
+    middleware = ProfilingMiddleware(slow_endpoint, store, secret="s3cret", interval=0.001)
+    signature = sign_profile_request("s3cret", "GET", "/api/rdp-servers", int(time.time()) + 60)
+
+    await call(middleware, "/api/rdp-servers", [(b"x-profile-signature", signature.encode())])
+
+    [profile] = store.list()
+    assert profile["path"] == "/api/rdp-servers"
+    assert profile["status_code"] == 200
+    folded = store.read(profile["id"])
+    assert "slow_endpoint" in folded
+    assert "sleep" in folded
+
+
+async def test_unsigned_or_expired_requests_are_not_profiled(tmp_path):
+    store = ProfileStore(tmp_path)
+    middleware = ProfilingMiddleware(slow_endpoint, store, secret="s3cret")
+    expired = sign_profile_request("s3cret", "GET", "/api/connections", int(time.time()) - 1)
+    forged = sign_profile_request("wrong", "GET", "/api/connections", int(time.time()) + 60)
+    long_lived = sign_profile_request("s3cret", "GET", "/api/connections", int(time.time()) + 3600)
+
+    await call(middleware, "/api/connections")
+    await call(middleware, "/api/connections", [(b"x-profile-signature", expired.encode())])
+    await call(middleware, "/api/connections", [(b"x-profile-signature", forged.encode())])
+    await call(middleware, "/api/connections", [(b"x-profile-signature", long_lived.encode())])
+
+    assert store.list() == []
+
+
+def test_store_keeps_only_newest_profiles(tmp_path):
+    store = ProfileStore(tmp_path, max_profiles=3)
+    ids = [store.save(Counter({"main;handler": i + 1}), {"path": f"/api/{i}"}) for i in range(5)]
+
+    assert [profile["id"] for profile in store.list()] == ids[:1:-1]
+    assert store.read(ids[0]) is None
+    assert store.read(ids[-1]) == "main;handler 5\n"
+
+
+def test_signature_lifetime_is_configurable():
+    middleware = ProfilingMiddleware(slow_endpoint, None, secret="s3cret", max_signature_age=7200)
+    signature = sign_profile_request("s3cret", "GET", "/api/connections", int(time.time()) + 3600)
+    scope = {"method": "GET", "path": "/api/connections", "headers": [(b"x-profile-signature", signature.encode())]}
+
+    assert middleware.should_profile(scope)
@@ -0,0 +1,85 @@
+"""Explain-plan checks for the rdp-servers search queries.
+
+Requires the MongoDB at MONGO_URL (backend/.env by default); skipped when it is not reachable.
+"""
+import os
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from server import RDPServer
+from storage import RDP_SERVER_INDEXES, build_rdp_server_query, encode_cursor
+
+
+@pytest.fixture(scope="module")
+def collection():
+    client = MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        pytest.skip("MongoDB is not available")
+    collection = client[os.environ.get("DB_NAME", "test_database")]["rdp_servers_explain_test"]
+    collection.drop()
+    collection.create_indexes(RDP_SERVER_INDEXES)
+    collection.insert_many([
+        RDPServer(name=f"Server {i}", host=f"host-{i}.example.com", username="admin",
+                  os_type=["windows", "linux"][i % 2], description="explain test").dict()
+        for i in range(50)
+    ])
+    yield collection
+    collection.drop()
+    client.close()
+
+
+def plan_stages(plan):
+    yield plan["stage"]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        yield from plan_stages(child)
+
+
+def winning_stages(collection, query, sort_spec):
+    explain = collection.find(query).sort(sort_spec).limit(101).explain()
+    return set(plan_stages(explain["queryPlanner"]["winningPlan"]))
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"sort": "-name"},
+    {"sort": "host"},
+    {"sort": "-updated_at"},
+    {"q": "Server"},
+    {"q": "Server", "os_type": "linux"},
+    {"os_type": "windows"},
+    {"os_type": "windows", "status": "inactive"},
+    {"status": "active", "sort": "-created_at"},
+    {"host": "host-1"},
+    {"host": "host-1", "sort": "host"},
+])
+def test_search_queries_never_scan_the_collection(collection, params):
+    query, sort_spec = build_rdp_server_query(**params)
+    assert "COLLSCAN" not in winning_stages(collection, query, sort_spec)
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"sort": "-name"},
+    {"sort": "-updated_at"},
+    {"os_type": "windows"},
+    {"os_type": "linux", "sort": "-created_at"},
+    {"os_type": "windows", "status": "inactive"},
+    {"status": "active", "sort": "-created_at"},
+    {"host": "host-1", "sort": "host"},
+])
+def test_indexed_shapes_are_returned_in_index_order(collection, params):
+    query, sort_spec = build_rdp_server_query(**params)
+    assert "SORT" not in winning_stages(collection, query, sort_spec)
+
+
+def test_cursor_pages_use_an_index(collection):
+    first = list(collection.find().sort([("name", 1), ("id", 1)]).limit(10))
+    query, sort_spec = build_rdp_server_query(sort="name", cursor=encode_cursor(first[-1], "name"))
+    assert "COLLSCAN" not in winning_stages(collection, query, sort_spec)
+
+    next_page = list(collection.find(query).sort(sort_spec).limit(10))
+    assert next_page[0]["name"] > first[-1]["name"]
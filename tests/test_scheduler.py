@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from scheduler import JobScheduler
+from storage import MemoryStorage
+
+
+async def test_only_one_worker_runs_a_job_per_lease():
+    storage = MemoryStorage()
+    runs = []
+
+    async def job():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+
+    workers = [JobScheduler(storage, owner=f"worker-{i}") for i in range(4)]
+    for worker in workers:
+        worker.add_job("cleanup", job, interval=60)
+    ran = await asyncio.gather(*(worker.run_once(worker.jobs["cleanup"]) for worker in workers))
+
+    assert sum(ran) == 1 and len(runs) == 1
+    assert sum(worker.jobs["cleanup"].skipped for worker in workers) == 3
+
+
+async def test_expired_lease_moves_to_another_worker():
+    storage = MemoryStorage()
+    first, second = JobScheduler(storage, "a"), JobScheduler(storage, "b")
+
+    async def job():
+        return "done"
+
+    for worker in (first, second):
+        worker.add_job("reconcile", job, interval=0.02)
+    assert await first.run_once(first.jobs["reconcile"])
+    assert not await second.run_once(second.jobs["reconcile"])
+    await asyncio.sleep(0.03)
+    assert await second.run_once(second.jobs["reconcile"])
+
+    stats = second.jobs["reconcile"].stats()
+    assert stats["runs"] == 1 and stats["last_result"] == "done"
+
+
+async def test_failures_are_counted_and_do_not_stop_the_loop():
+    scheduler = JobScheduler(MemoryStorage(), "a")
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    scheduler.add_job("broken", broken, interval=0.01, jitter=0)
+    scheduler.start()
+    await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    stats = scheduler.jobs["broken"].stats()
+    assert stats["runs"] >= 2 and stats["failures"] == stats["runs"]
+    assert "boom" in stats["last_error"]
+
+
+async def test_stale_sessions_are_ended_and_statuses_recomputed(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+
+    active = server.RDPServer(name="busy", host="a", username="u", status="inactive")
+    stale = server.RDPServer(name="stale", host="b", username="u", status="active")
+    for rdp_server in (active, stale):
+        await storage.insert_server(rdp_server.dict())
+    await storage.insert_connection(server.RDPConnection(server_id=active.id, session_id="1", status="active").dict())
+    await storage.insert_connection(server.RDPConnection(
+        server_id=stale.id, session_id="2", status="connecting",
+        started_at=datetime.utcnow() - timedelta(hours=server.STALE_SESSION_HOURS + 1)
+    ).dict())
+
+    assert await server.cleanup_stale_sessions() == {"ended": 1}
+    assert await server.recompute_server_statuses() == {"changed": 1}
+    assert storage.servers[active.id]["status"] == "active"
+    assert storage.servers[stale.id]["status"] == "inactive"
+
+
+async def test_cleanup_pages_past_the_first_thousand_sessions(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+    rdp_server = server.RDPServer(name="busy", host="a", username="u", status="active")
+    await storage.insert_server(rdp_server.dict())
+    old = datetime.utcnow() - timedelta(hours=server.STALE_SESSION_HOURS + 1)
+    for i in range(1200):
+        await storage.insert_connection(server.RDPConnection(
+            server_id=rdp_server.id, session_id=str(i), status="active", started_at=old + timedelta(seconds=i)
+        ).dict())
+    await storage.insert_connection(server.RDPConnection(server_id=rdp_server.id, session_id="fresh", status="active").dict())
+
+    assert await server.cleanup_stale_sessions() == {"ended": 1200}
+    assert await storage.count_connections(rdp_server.id, ["active"]) == 1
+    assert storage.servers[rdp_server.id]["status"] == "active"
+
+
+async def test_recompute_counts_open_connections_in_one_query(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+    servers = [server.RDPServer(name=f"s{i}", host="h", username="u", status="active") for i in range(6)]
+    for rdp_server in servers:
+        await storage.insert_server(rdp_server.dict())
+    await storage.insert_connection(server.RDPConnection(server_id=servers[0].id, session_id="1", status="active").dict())
+
+    async def no_per_server_counts(server_id, statuses):
+        raise AssertionError("counted connections of a single server")
+
+    monkeypatch.setattr(storage, "count_connections", no_per_server_counts)
+    assert await server.recompute_server_statuses() == {"changed": 5}
+    assert [storage.servers[s.id]["status"] for s in servers] == ["active"] + ["inactive"] * 5
+    assert await server.recompute_server_statuses() == {"changed": 0}
+
+
+async def test_recompute_does_not_overwrite_concurrent_status_changes(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+    idle = server.RDPServer(name="idle", host="a", username="u", status="active")
+    starting = server.RDPServer(name="starting", host="b", username="u", status="active")
+    for rdp_server in (idle, starting):
+        await storage.insert_server(rdp_server.dict())
+    update_servers = storage.update_servers
+
+    async def session_started_meanwhile(server_ids, fields, **conditions):
+        # A connection to `starting` opens after the aggregation read no open sessions
+        await storage.insert_connection(server.RDPConnection(server_id=starting.id, session_id="1", status="active").dict())
+        await storage.update_server(starting.id, {"status": "active", "updated_at": datetime.utcnow()})
+        return await update_servers(server_ids, fields, **conditions)
+
+    monkeypatch.setattr(storage, "update_servers", session_started_meanwhile)
+    assert await server.recompute_server_statuses() == {"changed": 1}
+    assert storage.servers[idle.id]["status"] == "inactive"
+    assert storage.servers[starting.id]["status"] == "active"
+
+
+class FlakyLeases(MemoryStorage):
+    """Grants the first lease, then answers renewals from `renewals` in turn"""
+
+    def __init__(self, renewals):
+        super().__init__()
+        self.renewals = list(renewals)
+        self.granted = False
+
+    async def acquire_lease(self, name, owner, ttl_seconds):
+        if not self.granted:
+            self.granted = True
+            return True
+        renewal = self.renewals.pop(0) if self.renewals else True
+        if isinstance(renewal, Exception):
+            raise renewal
+        return renewal
+
+
+async def test_lost_renewal_is_counted_and_logged(caplog):
+    scheduler = JobScheduler(FlakyLeases([False]), "a")
+    scheduler.add_job("slow", lambda: asyncio.sleep(0.05), interval=0.03)
+
+    assert await scheduler.run_once(scheduler.jobs["slow"])
+    stats = scheduler.jobs["slow"].stats()
+    assert stats["lost_leases"] == 1 and not stats["leader"] and stats["failures"] == 0
+    assert "lost its lease" in caplog.text
+
+
+async def test_renewal_errors_are_logged_and_retried(caplog):
+    scheduler = JobScheduler(FlakyLeases([RuntimeError("database unavailable"), True]), "a")
+    scheduler.add_job("slow", lambda: asyncio.sleep(0.05), interval=0.03)
+
+    assert await scheduler.run_once(scheduler.jobs["slow"])
+    stats = scheduler.jobs["slow"].stats()
+    assert stats["lost_leases"] == 0 and stats["leader"]
+    assert "Could not renew the lease of job slow" in caplog.text
+    assert "database unavailable" in caplog.text